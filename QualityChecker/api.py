@@ -0,0 +1,398 @@
+"""
+Программный вход в проверки без запуска main.py: run_checks для одной среды, run_envs для нескольких сред
+со сводным отчетом расхождений. Возвращают типизированные результаты (RunResult, EnvResult, TableResult).
+
+Приемники результатов (sinks): 'csv' - журнал reports/<отчет>/*.csv, 'xlsx' - еще и xlsx по журналу,
+'history' - история метрик и лист Anomalies. Без приемников результаты только возвращаются.
+pandas и openpyxl импортируются только для 'xlsx', pyarrow - только при export_evidence.
+Пулы соединений остаются открытыми между вызовами, закрывает их close_pools().
+Запуск, прерванный падением, продолжается с resume=True (последний запуск) или resume='<дата запуска>'.
+QueryMemo, трасса и кэш результатов - общие на процесс, поэтому одновременные вызовы run_checks/run_envs
+из разных потоков выполняются по очереди (_run_lock). Несколько сред одного запуска проверяются параллельно.
+"""
+import fnmatch
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from conf import vertica_conn_dict, run_conf
+from envdiff import diff_environments
+from runner import RunContext, check_table
+from trends import find_anomalies
+from utils.cache import ResultCache, set_result_cache, close_result_caches
+from utils.catalog import load_catalog
+from utils.checkpoint import CheckpointJournal
+from utils.databaseTools import run_sql, configure_pool, pool_stats, node_stats, start_query_memo, stop_query_memo, \
+    select_server_costs
+from utils.evidence import EvidenceSink
+from utils.governor import TimeGovernor
+from utils.history import HistoryStore
+from utils.report import ReportSink
+from utils.scheduler import run_parallel
+from utils.state import StateStore
+from utils.trace import Tracer, set_tracer, get_tracer
+from utils.utils import read_file_content
+
+path = os.path.dirname(os.path.abspath(__file__))
+
+# Один запуск на процесс: start_query_memo, set_tracer и set_result_cache меняют глобальное состояние
+_run_lock = threading.Lock()
+
+DEFAULT_SINKS = ('csv', 'xlsx', 'history')
+
+DEFAULT_SETTINGS = {
+    'dialect': 'Vertica',
+    # Номера проверок (список в README)
+    'checks': [2, 3, 5, 8, 10, 13, 1, 11, 12, 9, 14],
+    # Сколько колонок проверок 2, 3, 4, 8 считать одним запросом. Для очень широких таблиц уменьшить.
+    'profile_batch_size': 100,
+    # Инкрементальный режим: проверки 2, 3, 4, 8 читают только строки, загруженные после прошлого запуска.
+    # Проверка 1 - тоже, если tech_load_ts в ключе и не заданы проверки 11, 12: с ними ключи считаются
+    # одним полным проходом (как в проверках по умолчанию). Состояние хранится в state/<среда>_state.sqlite
+    'incremental': False,
+    # Приближенный режим для огромных таблиц: проверка 7 по выборке sample_percent % строк (TABLESAMPLE),
+    # проверки 11, 12 через APPROXIMATE_COUNT_DISTINCT, если не нужна проверка 1. Оценки помечаются погрешностью.
+    # Чтобы пересчитать точно, добавить 'схема.таблица.колонка' (или 'схема.таблица') в exact_columns.
+    'approximate': False,
+    'sample_percent': 1,
+    'approximate_error': 1.25,
+    'exact_columns': [],
+    # Кэш результатов между запусками (cache/<среда>_results.sqlite): неизменившиеся таблицы не пересчитываются.
+    # Изменение определяется по мете хранения (projection_storage, delete_vectors) пары ODS/STG.
+    'use_cache': False,
+    # Проверка 6. compare_mode = 'hash' - сравнивать STG и ODS по одному хэшу бизнес-колонок (для широких таблиц).
+    # increment_buckets > 1 - проверять огромные таблицы частями по хэшу ключа; при incremental = True готовые
+    # части сохраняются в state/<среда>_state.sqlite и после падения не пересчитываются.
+    # increment_mismatch_limit - сколько отличающихся ключей выбрать.
+    'compare_mode': 'columns',
+    'increment_buckets': 1,
+    'increment_mismatch_limit': 0,
+    # Бюджеты времени в секундах (None - без ограничения). Запрос, превысивший бюджет, отменяется на сервере,
+    # проверки 1/11/12, 6 и 7 пересчитываются более дешевым вариантом, остальные помечаются 'Таймаут'.
+    # check_time_limits - по номеру проверки, например {7: 600, 6: 1800}. После 80 % run_time_limit проверки 6, 7, 8
+    # пропускаются, после истечения run_time_limit пропускаются все оставшиеся проверки ('Пропущено').
+    'check_time_limits': {},
+    'default_check_time_limit': None,
+    'table_time_limit': None,
+    'run_time_limit': None,
+    # Замеры времени: каждый запрос и каждая проверка пишутся в reports/<отчет>/trace.jsonl и на лист Timings.
+    # trace_server_cost = True - дополнительно взять стоимость запросов на сервере из query_requests.
+    'trace': True,
+    'trace_server_cost': False,
+    # Выгрузка строк-доказательств: для проверок 1, 13 (строки с дублями ключа), 4 (строки с не utf-8 символами)
+    # и 6 (ключи вставок, обновлений, удалений), нашедших проблему, строки пишутся в reports/<отчет>/evidence/*.parquet
+    # (нужен pyarrow). evidence_row_cap - сколько строк выгружать по одной проверке одной таблицы.
+    'export_evidence': False,
+    'evidence_row_cap': 100000,
+    # История (приемник 'history'): количество строк и ключей сравнивается с прошлым запуском (изменение больше
+    # anomaly_change_threshold) и с обычным разбросом таблицы за history_depth запусков.
+    'history_depth': 30,
+    'anomaly_change_threshold': 0.3,
+    # Проверка 9 считается по мете хранения: перекос - строки на самой загруженной ноде к среднему по нодам.
+    # Проекции с перекосом больше segmentation_skew_threshold помечаются на листе Segmentation (alert = 1).
+    'segmentation_skew_threshold': 1.2,
+    # Режим catalog-first: количество строк (проверки 10, 11) и пустота таблицы берутся из меты хранения
+    # (projection_storage, delete_vectors), если проекции актуальны, иначе считаются запросом. analyze_statistics
+    # запускается только для таблиц, статистика которых старше analyze_max_age_hours, и не больше analyze_limit раз
+    # за запуск (None - без ограничения). Мета старше catalog_max_age секунд перед проверкой таблицы перечитывается.
+    'catalog_first': False,
+    'analyze_max_age_hours': 24,
+    'analyze_limit': None,
+    'catalog_max_age': 600,
+    # Журнал прогресса reports/<отчет>/checkpoint.jsonl (нужен приемник 'csv' или 'xlsx'): результат каждой задачи
+    # проверок таблицы пишется сразу. При продолжении запуска (--resume) с теми же проверками и RESULT_SETTINGS
+    # готовые задачи не пересчитываются, а листы отчета собираются заново из журнала.
+    'checkpoint': True,
+    # Проверка 7: top distribution_top_k частых значений каждой колонки с долями, NULL и пустые строки отдельно.
+    # Колонки считаются пачками по distribution_batch_size одним запросом (GROUPING SETS). Для колонок, у которых
+    # различных значений больше distribution_max_distinct (идентификаторы), top не считается.
+    'distribution_top_k': 5,
+    'distribution_max_distinct': 100000,
+    'distribution_batch_size': 20,
+}
+
+
+# Настройки, от которых зависят результаты проверок: продолжить запуск можно только с теми же значениями
+RESULT_SETTINGS = ('dialect', 'incremental', 'approximate', 'sample_percent', 'approximate_error', 'exact_columns',
+                   'compare_mode', 'increment_buckets', 'increment_mismatch_limit', 'catalog_first',
+                   'segmentation_skew_threshold', 'distribution_top_k', 'distribution_max_distinct')
+
+
+@dataclass
+class TableResult:
+    """Результат одной таблицы. status: 'ok', 'empty' (таблица пустая) или 'failed' (проверка упала, см. error)."""
+    schema: str
+    table: str
+    status: str
+    general: Dict[str, object] = field(default_factory=dict)
+    detail: List[Dict[str, object]] = field(default_factory=list)
+    sheets: Dict[str, List[Dict[str, object]]] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class EnvResult:
+    env: str
+    tables: List[TableResult]
+    started: str
+    finished: str
+    report_dir: Optional[str] = None
+    xlsx_path: Optional[str] = None
+    anomalies: List[Dict[str, object]] = field(default_factory=list)
+    evidence: List[Dict[str, object]] = field(default_factory=list)
+
+    @property
+    def empty_tables(self) -> List[str]:
+        return [f'{result.schema}.{result.table}' for result in self.tables if result.status == 'empty']
+
+    @property
+    def failed_tables(self) -> List[str]:
+        return [f'{result.schema}.{result.table}' for result in self.tables if result.status == 'failed']
+
+    def general_rows(self) -> List[Dict[str, object]]:
+        return [result.general for result in self.tables if result.status == 'ok']
+
+    def detail_rows(self) -> List[Dict[str, object]]:
+        return [row for result in self.tables if result.status == 'ok' for row in result.detail]
+
+
+@dataclass
+class RunResult:
+    envs: Dict[str, EnvResult]
+    run_id: str
+    resumed: bool = False
+    diff_dir: Optional[str] = None
+    general_diff: List[Dict[str, object]] = field(default_factory=list)
+    detail_diff: List[Dict[str, object]] = field(default_factory=list)
+    # Среды, проверка которых упала целиком (например, нет подключения)
+    errors: Dict[str, Exception] = field(default_factory=dict)
+    # Открытые соединения и выполненные запросы (pool_stats), состояние нод сред (node_stats) и попадания QueryMemo
+    stats: Dict[str, object] = field(default_factory=dict)
+
+
+def select_tables(dialect, connection, tables=None):
+    """
+    Таблицы для проверки: [(схема, таблица)]. tables - 'схема.таблица' или шаблоны fnmatch ('ODS_CRM.*').
+    Без шаблонов список берется как есть, запрос get_tables_sql_query.sql не выполняется.
+    """
+    if tables and not any(char in name for name in tables for char in '*?['):
+        return [tuple(name.split('.', 1)) for name in tables]
+    obj_list = run_sql(dialect, read_file_content(f'{path}/get_tables_sql_query.sql'), connection)
+    if not tables:
+        return obj_list
+    patterns = [name.lower() for name in tables]
+    return [obj for obj in obj_list
+            if any(fnmatch.fnmatchcase(f'{obj[0]}.{obj[1]}'.lower(), pattern) for pattern in patterns)]
+
+
+def settings_fingerprint(checks, settings):
+    """Отпечаток списка проверок и RESULT_SETTINGS для журнала прогресса."""
+    values = {'checks': sorted(checks), **{name: settings[name] for name in RESULT_SETTINGS}}
+    return hashlib.md5(json.dumps(values, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def _new_run_id(envs):
+    """Дата запуска до секунды. Если папка отчета с такой датой уже есть, добавляется номер."""
+    started = time.strftime('%Y-%m-%d_%H-%M-%S')
+    run_id = started
+    number = 1
+    while any(glob.glob(f'{path}/reports/{env}_*_{run_id}') for env in envs):
+        number += 1
+        run_id = f'{started}_{number}'
+    return run_id
+
+
+def latest_run_id(envs):
+    """Дата последнего запуска сред envs с журналом прогресса или None."""
+    journals = [journal for env in envs for journal in glob.glob(f'{path}/reports/{env}_report_*/checkpoint.jsonl')]
+    if not journals:
+        return None
+    latest = max(journals, key=os.path.getmtime)
+    return os.path.basename(os.path.dirname(latest)).split('_report_', 1)[1]
+
+
+def build_context(env, connection, checks, catalog, settings, check_workers=1, evidence=None, state=None,
+                  checkpoint=None):
+    """RunContext по настройкам (DEFAULT_SETTINGS с переопределениями). Бюджет run_time_limit - от вызова."""
+    return RunContext(settings['dialect'], connection, checks, catalog,
+                      profile_batch_size=settings['profile_batch_size'], check_workers=check_workers, state=state,
+                      incremental=settings['incremental'], approximate=settings['approximate'],
+                      sample_percent=settings['sample_percent'], approximate_error=settings['approximate_error'],
+                      exact_columns=settings['exact_columns'], compare_mode=settings['compare_mode'],
+                      increment_buckets=settings['increment_buckets'],
+                      mismatch_limit=settings['increment_mismatch_limit'],
+                      governor=TimeGovernor(settings['check_time_limits'], settings['default_check_time_limit'],
+                                            settings['table_time_limit'], settings['run_time_limit']),
+                      evidence=evidence, catalog_first=settings['catalog_first'],
+                      analyze_max_age=settings['analyze_max_age_hours'] * 3600,
+                      analyze_limit=settings['analyze_limit'], catalog_max_age=settings['catalog_max_age'],
+                      skew_threshold=settings['segmentation_skew_threshold'], env=env, checkpoint=checkpoint,
+                      top_k=settings['distribution_top_k'], max_distinct=settings['distribution_max_distinct'],
+                      distribution_batch_size=settings['distribution_batch_size'])
+
+
+def _run_env(env, tables, checks, sinks, settings, run_id, resume=False):
+    dialect = settings['dialect']
+    connection = vertica_conn_dict[env]
+    started = time.strftime('%Y-%m-%d %H:%M:%S')
+    # Параллельность подбирается под ресурсный пул Vertica: одновременно открыто до table_workers * check_workers сессий
+    table_workers = run_conf.get(env, {}).get('table_workers', 1)
+    check_workers = run_conf.get(env, {}).get('check_workers', 1)
+    configure_pool(connection, max_size=table_workers * check_workers, dialect=dialect)
+
+    obj_list = select_tables(dialect, connection, tables)
+    # Вся мета (колонки, ключи) по всем таблицам грузится заранее несколькими запросами
+    catalog = load_catalog(dialect, path, obj_list, connection, catalog_first=settings['catalog_first'])
+
+    report_name = f'{env}_report_{run_id}'
+    # Результаты каждой таблицы сразу дописываются в журнал reports/<отчет>/General.csv, Detail.csv
+    report = ReportSink(f'{path}/reports/{report_name}') if {'csv', 'xlsx'} & set(sinks) else None
+    checkpoint = None
+    if settings['checkpoint'] and report is not None:
+        # При продолжении запуска с другими настройками падает здесь, до того как листы отчета очищены
+        checkpoint = CheckpointJournal(f'{report.journal_dir}/checkpoint.jsonl', settings_fingerprint(checks, settings),
+                                       resume=resume)
+    if resume and report is not None:
+        # Листы прерванного запуска неполные: все таблицы пишутся в них заново, готовые - из журнала прогресса
+        report.clear()
+    if settings['use_cache']:
+        set_result_cache(ResultCache(f'{path}/cache/{env}_results.sqlite', env, dialect, path, connection))
+    history = HistoryStore(f'{path}/history/{env}_history.sqlite', env, run_id=run_id) if 'history' in sinks else None
+    if resume and history is not None:
+        history.discard_run()
+    evidence = None
+    if settings['export_evidence'] and report is not None:
+        evidence = EvidenceSink(f'{report.journal_dir}/evidence', settings['evidence_row_cap'])
+    state = None
+    if settings['incremental'] or settings['increment_buckets'] > 1:
+        state = StateStore(f'{path}/state/{env}_state.sqlite')
+    ctx = build_context(env, connection, checks, catalog, settings, check_workers, evidence, state, checkpoint)
+
+    print(env, obj_list)
+    results = []
+    # Таблицы проверяются параллельно, самые большие запускаются первыми, результаты пишутся в порядке obj_list
+    for obj, result, error in run_parallel(obj_list, lambda obj: check_table(ctx, obj[0], obj[1]), table_workers,
+                                           priority=lambda obj: catalog.row_count(obj[0], obj[1])):
+        schema = obj[0]
+        table = obj[1]
+        if error is not None:
+            results.append(TableResult(schema, table, 'failed', error=repr(error)))
+            continue
+        if result is None:
+            results.append(TableResult(schema, table, 'empty'))
+            continue
+
+        general_row, detail_rows, sheets = result
+        results.append(TableResult(schema, table, 'ok', general_row, detail_rows, sheets))
+        if report is not None:
+            report.write('General', [general_row])
+            report.write('Detail', detail_rows)
+            for sheet, rows in sheets.items():
+                report.write(sheet, rows)
+        if history is not None:
+            history.append([general_row])
+            history.append(detail_rows)
+
+    env_result = EnvResult(env, results, started, time.strftime('%Y-%m-%d %H:%M:%S'))
+    tracer = get_tracer()
+    if tracer is not None and report is not None:
+        if tracer.server_cost:
+            try:
+                tracer.add_server_costs(select_server_costs(dialect, path, tracer.labels(env), connection))
+            except Exception:
+                logging.warning(f'{env}: не удалось получить стоимость запросов на сервере')
+        report.write('Timings', tracer.timing_rows(env))
+    if evidence is not None:
+        env_result.evidence = evidence.files()
+    if history is not None:
+        env_result.anomalies = find_anomalies(history, settings['history_depth'], settings['anomaly_change_threshold'])
+        history.close()
+    if state is not None:
+        state.close()
+    if checkpoint is not None:
+        logging.info(f'{env}: задачи журнала прогресса по статусам: {checkpoint.stats()}')
+        checkpoint.close()
+
+    if report is not None:
+        report.write('Evidence', env_result.evidence)
+        report.write('Anomalies', env_result.anomalies)
+        env_result.report_dir = report.journal_dir
+        if 'xlsx' in sinks:
+            env_result.xlsx_path = report.render_xlsx(f'{path}/reports/{report_name}.xlsx')
+    return env_result
+
+
+def run_envs(envs, tables=None, checks=None, sinks=DEFAULT_SINKS, settings=None, resume=None):
+    """
+    Проверяет среды envs одновременно, каждую на своем пуле соединений. Если сред несколько и есть приемник
+    'csv' или 'xlsx', собирает сводный отчет reports/<среды>_diff_<дата> (envdiff.diff_environments).
+    settings переопределяют DEFAULT_SETTINGS, checks - settings['checks'].
+    resume - продолжить прерванный запуск: True - последний (latest_run_id), строка - дата запуска.
+    Проверки и RESULT_SETTINGS должны быть те же, что у прерванного запуска, иначе среда падает с ValueError.
+    Вызов, начатый, пока идет другой запуск в этом процессе, ждет его окончания.
+    """
+    with _run_lock:
+        return _run_envs(envs, tables, checks, sinks, settings, resume)
+
+
+def _run_envs(envs, tables, checks, sinks, settings, resume):
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    checks = list(checks if checks is not None else settings['checks'])
+    envs = list(envs)
+    run_id = latest_run_id(envs) if resume is True else resume
+    if resume and run_id is None:
+        logging.warning(f'{", ".join(envs)}: нет прерванного запуска с журналом прогресса, начинаем новый')
+    resumed = run_id is not None
+    run_id = run_id or _new_run_id(envs)
+    has_report = bool({'csv', 'xlsx'} & set(sinks))
+    diff_dir = f'{path}/reports/{"_".join(envs)}_diff_{run_id}' if len(envs) > 1 and has_report else None
+
+    # Одинаковые запросы в пределах запуска выполняются один раз
+    start_query_memo()
+    if settings['trace'] and has_report:
+        # Трасса общая на все среды запуска, замеры помечены средой
+        trace_dir = diff_dir or f'{path}/reports/{envs[0]}_report_{run_id}'
+        set_tracer(Tracer(f'{trace_dir}/trace.jsonl', server_cost=settings['trace_server_cost']))
+    try:
+        env_results = {}
+        errors = {}
+        for env, result, error in run_parallel(envs, lambda env: _run_env(env, tables, checks, sinks, settings,
+                                                                          run_id, resumed), len(envs)):
+            if error is not None:
+                errors[env] = error
+                continue
+            env_results[env] = result
+    finally:
+        set_tracer(None)
+        memo = stop_query_memo()
+        close_result_caches()
+
+    stats = {'pool': pool_stats(), 'memo': memo,
+             'nodes': {env: node_stats(vertica_conn_dict[env], settings['dialect']) for env in env_results}}
+    run_result = RunResult(env_results, run_id, resumed, errors=errors, stats=stats)
+    if len(env_results) > 1:
+        run_result.general_diff, run_result.detail_diff = diff_environments(
+            {env: (result.general_rows(), result.detail_rows()) for env, result in env_results.items()})
+        if diff_dir is not None:
+            diff_report = ReportSink(diff_dir, sheets=('General diff', 'Detail diff'))
+            diff_report.clear()
+            diff_report.write('General diff', run_result.general_diff)
+            diff_report.write('Detail diff', run_result.detail_diff)
+            if 'xlsx' in sinks:
+                diff_report.render_xlsx(f'{diff_dir}.xlsx')
+            run_result.diff_dir = diff_dir
+    return run_result
+
+
+def run_checks(env, tables=None, checks=None, sinks=DEFAULT_SINKS, settings=None, resume=None):
+    """Проверяет одну среду. Ошибка, из-за которой упала проверка всей среды, пробрасывается."""
+    result = run_envs([env], tables, checks, sinks, settings, resume)
+    if env in result.errors:
+        raise result.errors[env]
+    return result.envs[env]
@@ -0,0 +1,229 @@
+"""
+Бенчмарк проверок на локальном бэкенде SQLite (utils.localdb), без кластера Vertica.
+
+Генерирует пары таблиц ODS_BENCH/STG_BENCH нужных размеров с заданной долей пустых значений, дублей по ключу
+и битых (не utf-8) строк, замеряет каждую проверку 1-14 отдельно и весь конвейер main.py (мета, проверки
+всех таблиц, журнал отчета) и сохраняет результат в benchmarks/<дата>.json. Если указан compare_with,
+печатает сравнение с прошлым замером: так видно, ускорило или замедлило изменение каждую проверку.
+
+Запуск: python .\\benchmark.py
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from checks import check_pk_doubles, profile_column_aggregates, check_max_tech_load_ts, check_increment, \
+    check_value_distribution, check_segmentation, check_row_count, check_bussines_key_counts, check_key_profile
+from runner import RunContext, check_table
+from utils.catalog import load_catalog
+from utils.databaseTools import configure_pool, close_pools
+from utils.localdb import PRIMARY_KEYS_TABLE
+from utils.report import ReportSink
+from utils.scheduler import run_parallel
+
+DIALECT = 'SQLite'
+ODS_SCHEMA = 'ODS_BENCH'
+STG_SCHEMA = 'STG_BENCH'
+LOAD_TS = '2024-02-01 00:00:00'
+ALL_CHECKS = list(range(1, 15))
+
+# (количество строк ODS, количество бизнес-колонок). Половина колонок текстовые varchar(20), половина числовые
+sizes = [(10000, 10), (100000, 10), (100000, 50)]
+null_ratio = 0.1
+duplicate_ratio = 0.01
+not_utf8_ratio = 0.001
+# Доля ключей ODS, изменившихся в последней загрузке STG (половина обновления, половина новые ключи)
+increment_ratio = 0.05
+# Сколько раз повторить замер, в результат идет медиана
+repeats = 3
+workers = 2
+seed = 42
+# Путь к прошлому замеру (benchmarks/<дата>.json) и допустимое замедление в долях
+compare_with = None
+tolerance = 0.2
+
+
+def _text_value(rnd):
+    roll = rnd.random()
+    if roll < null_ratio:
+        return None
+    if roll < null_ratio + not_utf8_ratio:
+        return b'\xff\xfe' + 'x'.encode('utf8') * rnd.randint(1, 18)
+    return ''.join(rnd.choice('abcdefghij') for _ in range(rnd.randint(1, 20)))
+
+
+def _int_value(rnd):
+    return None if rnd.random() < null_ratio else rnd.randint(0, 1000)
+
+
+def generate_pair(database_dir, table, rows, columns):
+    """Создает {ODS_SCHEMA}.table и {STG_SCHEMA}.table в папке database_dir (по файлу на схему)."""
+    rnd = random.Random(seed)
+    text_columns = [f'txt_{i}' for i in range(columns - columns // 2)]
+    int_columns = [f'num_{i}' for i in range(columns // 2)]
+    # Полностью пустая колонка для проверки 2
+    column_defs = (['id integer', 'tech_load_ts varchar(19)', 'tech_job_id integer', 'tech_is_deleted integer']
+                   + [f'{col} varchar(20)' for col in text_columns] + [f'{col} integer' for col in int_columns]
+                   + ['empty_col varchar(10)'])
+
+    def make_row(key, load_ts):
+        return ([key, load_ts, 1, 0] + [_text_value(rnd) for _ in text_columns]
+                + [_int_value(rnd) for _ in int_columns] + [None])
+
+    history = [make_row(key, f'2024-01-{rnd.randint(1, 31):02d} 00:00:00') for key in range(rows)]
+    history += [list(rnd.choice(history)) for _ in range(int(rows * duplicate_ratio))]
+    increment_size = int(rows * increment_ratio)
+    updated_keys = rnd.sample(range(rows), increment_size // 2)
+    new_keys = range(rows, rows + increment_size - len(updated_keys))
+    # У обновленных ключей меняется первая текстовая колонка, чтобы проверка 6 увидела обновление
+    increment = []
+    for key in list(updated_keys) + list(new_keys):
+        row = make_row(key, LOAD_TS)
+        row[4] = f'upd_{key}'[:20]
+        increment.append(row)
+
+    # STG - полный снимок источника: неизменившиеся ключи приходят с теми же значениями, что уже лежат в ODS
+    changed_keys = set(updated_keys)
+    unchanged = [[row[0], LOAD_TS] + row[2:] for row in history[:rows] if row[0] not in changed_keys]
+
+    os.makedirs(database_dir, exist_ok=True)
+    placeholders = ', '.join('?' * len(column_defs))
+    for schema, data in ((ODS_SCHEMA, history + increment), (STG_SCHEMA, unchanged + increment)):
+        with sqlite3.connect(os.path.join(database_dir, f'{schema}.sqlite')) as connection:
+            connection.execute(f'drop table if exists {table}')
+            connection.execute(f'create table {table} ({", ".join(column_defs)})')
+            connection.executemany(f'insert into {table} values ({placeholders})', data)
+            connection.execute(f'create table if not exists {PRIMARY_KEYS_TABLE} '
+                               f'(table_name text, column_name text, ordinal_position integer)')
+            connection.execute(f'delete from {PRIMARY_KEYS_TABLE} where table_name = ?', (table,))
+            connection.executemany(f'insert into {PRIMARY_KEYS_TABLE} values (?, ?, ?)',
+                                   [(table, 'id', 1), (table, 'tech_load_ts', 2)])
+        connection.close()
+
+
+def _median_time(func):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings), 4)
+
+
+def time_checks(connection, table, catalog):
+    """Время каждой проверки по отдельности, плюс совмещенные запросы, которыми их выполняет runner."""
+    columns = catalog.columns(ODS_SCHEMA, table)
+    text_columns = catalog.text_columns(ODS_SCHEMA, table)
+
+    def profile(checks):
+        return lambda: profile_column_aggregates(DIALECT, ODS_SCHEMA, table, columns, text_columns, checks,
+                                                 connection)
+
+    cases = {
+        '1': lambda: check_pk_doubles(DIALECT, ODS_SCHEMA, table, connection, catalog),
+        '2': profile([2]),
+        '3': profile([3]),
+        '4': profile([4]),
+        '5': lambda: check_max_tech_load_ts(DIALECT, ODS_SCHEMA, table, connection),
+        '6': lambda: check_increment(DIALECT, ODS_SCHEMA, table, connection, catalog),
+        '6 hash': lambda: check_increment(DIALECT, ODS_SCHEMA, table, connection, catalog, compare_mode='hash'),
+        '7': lambda: check_value_distribution(DIALECT, ODS_SCHEMA, table, columns, connection),
+        '8': profile([8]),
+        '9': lambda: check_segmentation(DIALECT, ODS_SCHEMA, table, connection),
+        '10': lambda: check_row_count(DIALECT, STG_SCHEMA, table, connection),
+        '11': lambda: check_row_count(DIALECT, ODS_SCHEMA, table, connection),
+        '12': lambda: check_bussines_key_counts(DIALECT, ODS_SCHEMA, table, connection, catalog),
+        '13': lambda: check_pk_doubles(DIALECT, STG_SCHEMA, table, connection, catalog),
+        '14': lambda: check_max_tech_load_ts(DIALECT, STG_SCHEMA, table, connection),
+        '2, 3, 4, 8': profile([2, 3, 4, 8]),
+        '1, 11, 12': lambda: check_key_profile(DIALECT, ODS_SCHEMA, table, connection, catalog),
+    }
+    return {case: _median_time(func) for case, func in cases.items()}
+
+
+def time_pipeline(connection, obj_list):
+    """Тот же путь, что в main.py: мета одним заходом, проверки таблиц параллельно, журнал отчета."""
+    journal_dir = tempfile.mkdtemp(prefix='dq_bench_')
+
+    def pipeline():
+        catalog = load_catalog(DIALECT, os.path.dirname(os.path.abspath(__file__)), obj_list, connection)
+        ctx = RunContext(DIALECT, connection, ALL_CHECKS, catalog, check_workers=workers)
+        report = ReportSink(journal_dir)
+        for obj, result, error in run_parallel(obj_list, lambda obj: check_table(ctx, obj[0], obj[1]), workers):
+            if error is not None:
+                raise error
+            if result is not None:
+                report.write('General', [result[0]])
+                report.write('Detail', result[1])
+    try:
+        return _median_time(pipeline)
+    finally:
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+
+def compare(previous, current):
+    """Печатает отношение нового времени к старому по совпадающим замерам."""
+    old = {(row['rows'], row['columns'], row['check']): row['seconds'] for row in previous['results']}
+    regressions = []
+    print(f'{"строк":>10} {"колонок":>8} {"проверка":>14} {"было, с":>9} {"стало, с":>9} {"x":>6}')
+    for row in current['results']:
+        key = (row['rows'], row['columns'], row['check'])
+        if key not in old or not old[key]:
+            continue
+        ratio = row['seconds'] / old[key]
+        mark = ' <--' if ratio > 1 + tolerance else ''
+        print(f'{row["rows"]:>10} {row["columns"]:>8} {row["check"]:>14} {old[key]:>9} {row["seconds"]:>9} '
+              f'{ratio:>6.2f}{mark}')
+        if mark:
+            regressions.append(key)
+    return regressions
+
+
+def run_benchmark(data_dir, output_dir):
+    results = []
+    for rows, columns in sizes:
+        table = f'T_{rows}_{columns}'
+        connection = {'database': os.path.join(data_dir, f'{rows}x{columns}')}
+        print(f'Генерация {table}')
+        generate_pair(connection['database'], table, rows, columns)
+        configure_pool(connection, max_size=workers * workers, dialect=DIALECT)
+        obj_list = [(ODS_SCHEMA, table)]
+        catalog = load_catalog(DIALECT, os.path.dirname(os.path.abspath(__file__)), obj_list, connection)
+
+        print(f'Замер проверок {table}')
+        for check, seconds in time_checks(connection, table, catalog).items():
+            results.append({'rows': rows, 'columns': columns, 'check': check, 'seconds': seconds})
+        results.append({'rows': rows, 'columns': columns, 'check': 'pipeline',
+                        'seconds': time_pipeline(connection, obj_list)})
+
+    baseline = {
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'settings': {'null_ratio': null_ratio, 'duplicate_ratio': duplicate_ratio, 'not_utf8_ratio': not_utf8_ratio,
+                     'increment_ratio': increment_ratio, 'repeats': repeats, 'workers': workers, 'seed': seed},
+        'results': results,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f'{time.strftime("%Y-%m-%d_%H-%M")}.json')
+    with open(output_path, 'w', encoding='utf8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=1)
+    print(f'Результаты в {output_path}')
+    return baseline
+
+
+if __name__ == '__main__':
+    path = os.path.dirname(os.path.abspath(__file__))
+    current = run_benchmark(os.path.join(path, 'benchmarks', 'data'), os.path.join(path, 'benchmarks'))
+    if compare_with:
+        with open(compare_with, 'r', encoding='utf8') as f:
+            regressions = compare(json.load(f), current)
+        if regressions:
+            print(f'Замедление больше {tolerance:.0%}: {regressions}')
+    close_pools()
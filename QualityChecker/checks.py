@@ -1,15 +1,37 @@
 import logging
+import math
 import os
 
-from utils.databaseTools import run_sql
+from utils.cache import cached_check
+from utils.databaseTools import run_sql, sql_session, template_path, NULL_SAFE_EQUAL
+from utils.trace import traced_check
 from utils.utils import read_file_content, to_flat_list
 
 path = os.path.dirname(os.path.abspath(__file__))
 
 
+def select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog=None):
+    # Если мета загружена заранее (utils.catalog), берем ключ из нее, иначе идем в базу
+    if catalog is not None and (schema, table) in catalog:
+        return catalog.primary_keys(schema, table)
+    select_pk_path = template_path(dialect, f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql')
+    select_pk_script = read_file_content(select_pk_path).format(table=table, schema_name=schema)
+    return to_flat_list(run_sql(dialect, select_pk_script, vertica_conn_dict))
+
+
+def select_business_columns(dialect, schema, table, vertica_conn_dict, catalog=None):
+    if catalog is not None and (schema, table) in catalog:
+        return catalog.business_columns(schema, table)
+    select_bc_path = template_path(dialect, f'{path}/sql/work_with_meta/vertica/select_business_columns.sql')
+    select_bc_script = read_file_content(select_bc_path).format(table=table, schema_name=schema)
+    return to_flat_list(run_sql(dialect, select_bc_script, vertica_conn_dict))
+
+
+@traced_check
+@cached_check('sql/DQ/check_not_nulls_columns.sql')
 def check_null_fields(dialect, schema, table, column, vertica_conn_dict):
     script = read_file_content(
-        f'{path}/sql/DQ/check_not_nulls_columns.sql').format(
+        template_path(dialect, f'{path}/sql/DQ/check_not_nulls_columns.sql')).format(
         table=table, schema=schema, column=column)
     result = run_sql(dialect, script, vertica_conn_dict)
     if not result:
@@ -20,9 +42,11 @@ def check_null_fields(dialect, schema, table, column, vertica_conn_dict):
         return [[0]]
 
 
+@traced_check
+@cached_check('sql/DQ/check_max_length.sql')
 def max_length(dialect, schema, table, column, vertica_conn_dict):
     script = read_file_content(
-        f'{path}/sql/DQ/check_max_length.sql').format(
+        template_path(dialect, f'{path}/sql/DQ/check_max_length.sql')).format(
         table=table, schema=schema, column=column)
     result_cnt = run_sql(dialect, script, vertica_conn_dict)
     if result_cnt[0] == [1]:
@@ -33,16 +57,20 @@ def max_length(dialect, schema, table, column, vertica_conn_dict):
         return [[0]]
 
 
+@traced_check
+@cached_check('sql/DQ/check_max_tech_load_ts.sql')
 def check_max_tech_load_ts(dialect, schema, table, vertica_conn_dict):
     script = read_file_content(
-        f'{path}/sql/DQ/check_max_tech_load_ts.sql').format(
+        template_path(dialect, f'{path}/sql/DQ/check_max_tech_load_ts.sql')).format(
         table=table, schema=schema)
     result_cnt = run_sql(dialect, script, vertica_conn_dict)
     return result_cnt[0]
 
 
+@traced_check
+@cached_check('sql/DQ/check_row_count.sql')
 def check_row_count(dialect, schema, table, vertica_conn_dict):
-    check_row_count_path = f'{path}/sql/DQ/check_row_count.sql'
+    check_row_count_path = template_path(dialect, f'{path}/sql/DQ/check_row_count.sql')
     check_row_count_script = (read_file_content(check_row_count_path).
                               format(table=table,
                                      schema=schema))
@@ -50,21 +78,17 @@ def check_row_count(dialect, schema, table, vertica_conn_dict):
     return result
 
 
-def check_pk_doubles(dialect, schema, table, vertica_conn_dict):
-    select_pk_path = f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql'
-    select_pk_script = (read_file_content(select_pk_path).
-                        format(table=table,
-                               schema_name=schema))
-
-    pk_columns = run_sql(dialect, select_pk_script,
-                             vertica_conn_dict)
-    if bool(pk_columns):
+@traced_check
+@cached_check('sql/DQ/check_pk_doubles.sql')
+def check_pk_doubles(dialect, schema, table, vertica_conn_dict, catalog=None, where_clause='true'):
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    if bool(pk_columns_list):
         logging.info('Первичный ключ есть')
-        pk_columns_list = to_flat_list(pk_columns)
         pk_columns_str = ', '.join([f'{col}' for col in pk_columns_list])
 
-        check_pk_double_path = f'{path}/sql/DQ/check_pk_doubles.sql'
-        check_pk_script = read_file_content(check_pk_double_path).format(table=table, schema=schema, pk=pk_columns_str)
+        check_pk_double_path = template_path(dialect, f'{path}/sql/DQ/check_pk_doubles.sql')
+        check_pk_script = read_file_content(check_pk_double_path).format(table=table, schema=schema, pk=pk_columns_str,
+                                                                         where_clause=where_clause)
 
         result = to_flat_list(run_sql(dialect, check_pk_script, vertica_conn_dict))
         print(check_pk_script)
@@ -80,9 +104,11 @@ def check_pk_doubles(dialect, schema, table, vertica_conn_dict):
         logging.warning(f'Первичного ключа нет')
 
 
+@traced_check
+@cached_check('sql/DQ/check_not_utf8.sql')
 def not_utf8(dialect, schema, table, column, vertica_conn_dict):
     script = read_file_content(
-        f'{path}/sql/DQ/check_not_utf8.sql').format(
+        template_path(dialect, f'{path}/sql/DQ/check_not_utf8.sql')).format(
         table=table, schema=schema, column=column)
     result_cnt = run_sql(dialect, script, vertica_conn_dict)
     if not result_cnt:
@@ -93,41 +119,185 @@ def not_utf8(dialect, schema, table, column, vertica_conn_dict):
         return [[1]]
 
 
-def check_most_consistent_value(dialect, schema, table, column, vertica_conn_dict):
-    script = read_file_content(
-        f'{path}/sql/DQ/select_most_consistent_value.sql').format(
-        table=table, schema=schema, column=column)
-    result_cnt = run_sql(dialect, script, vertica_conn_dict)
-    logging.warning(f'{column} {result_cnt[0]} ')
-    return result_cnt
-
-
+@traced_check
+@cached_check('sql/DQ/select_columns_profile.sql', 'sql/DQ/select_value_distribution.sql')
+def check_value_distribution(dialect, schema, table, columns, vertica_conn_dict, top_k=5, max_distinct=100000,
+                             batch_size=20):
+    """
+    Проверка 7 для пачки колонок: top_k самых частых значений с количеством, корзины NULL и пустой строки.
+
+    Первый проход по таблице считает для batch_size колонок сразу количество строк, NULL, пустых строк
+    и приближенное количество различных значений. Второй - top значений одним запросом с GROUPING SETS,
+    только по колонкам, у которых различных значений не больше max_distinct: у колонок-идентификаторов
+    частых значений нет, а группировка по ним стоит как сортировка всей таблицы.
+
+    Возвращает {колонка: {'rows', 'nulls', 'empty', 'distinct', 'capped', 'top': [[значение, количество]]}}.
+    """
+    distribution = {}
+    for start in range(0, len(columns), batch_size):
+        batch = columns[start:start + batch_size]
+        select_list = ['count(1) as row_cnt']
+        for i, col in enumerate(batch):
+            select_list.extend([f'count(1) - count({col}) as null_{i}',
+                                f"count(case when to_char({col}) = '' then 1 end) as empty_{i}",
+                                f'APPROXIMATE_COUNT_DISTINCT({col}) as distinct_{i}'])
+        script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_columns_profile.sql')).format(
+            table=table, schema=schema, select_list=',\n'.join(select_list), where_clause='true')
+        row = iter(run_sql(dialect, script, vertica_conn_dict)[0])
+        rows = next(row)
+        for col in batch:
+            nulls, empty, distinct = next(row), next(row), next(row)
+            distribution[col] = {'rows': rows, 'nulls': nulls, 'empty': empty, 'distinct': distinct,
+                                 'capped': distinct > max_distinct, 'top': []}
+
+        grouped = [col for col in batch if not distribution[col]['capped']]
+        if not grouped:
+            continue
+        script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_value_distribution.sql')).format(
+            table=table, schema=schema, top_k=top_k,
+            value_list=', '.join(f'to_char({col}) as v_{i}' for i, col in enumerate(grouped)),
+            column_case='case ' + ' '.join(f'when grouping(v_{i}) = 0 then {i}' for i in range(len(grouped))) + ' end',
+            value_case='case ' + ' '.join(f'when grouping(v_{i}) = 0 then v_{i}' for i in range(len(grouped))) + ' end',
+            grouping_sets=', '.join(f'(v_{i})' for i in range(len(grouped))),
+            union_list='\nunion all\n'.join(f'select {i} as col_num, to_char({col}) as value, count(1) as cnt '
+                                             f'from {schema}.{table} group by to_char({col})'
+                                             for i, col in enumerate(grouped)))
+        for col_num, value, cnt in run_sql(dialect, script, vertica_conn_dict):
+            distribution[grouped[col_num]]['top'].append([value, cnt])
+    return distribution
+
+
+def format_value_distribution(distribution):
+    """Значение листа Detail: top значений колонки с долями, затем NULL и пустые строки."""
+    rows = distribution['rows']
+
+    def share(cnt):
+        return f'{cnt} ({cnt * 100 / rows:.2f} %)' if rows else str(cnt)
+    parts = [f"'{value}' {share(cnt)}" for value, cnt in distribution['top']]
+    if distribution['capped']:
+        parts.append(f"~{distribution['distinct']} различных значений, top не считался")
+    if distribution['nulls']:
+        parts.append(f"NULL {share(distribution['nulls'])}")
+    if distribution['empty']:
+        parts.append(f"'' {share(distribution['empty'])}")
+    return f"{'; '.join(parts)} из {rows}"
+
+
+@traced_check
+@cached_check('sql/DQ/select_columns_length_statistics.sql')
 def check_columns_length_statistics(dialect, schema, table, column, vertica_conn_dict):
     script = read_file_content(
-        f'{path}/sql/DQ/select_columns_length_statistics.sql').format(
+        template_path(dialect, f'{path}/sql/DQ/select_columns_length_statistics.sql')).format(
         table=table, schema=schema, column=column)
     result_cnt = run_sql(dialect, script, vertica_conn_dict)
     logging.warning(f'{column} {result_cnt[0]} ')
     return result_cnt
 
 
-def check_insert_new_rows(dialect, schema, table, vertica_conn_dict):
+def select_char_max_length(dialect, schema, table, vertica_conn_dict, catalog=None):
+    if catalog is not None and (schema, table) in catalog:
+        return catalog.char_max_length(schema, table)
+    max_length_path = template_path(dialect, f'{path}/sql/work_with_meta/vertica/select_columns_max_length.sql')
+    return dict(run_sql(dialect, read_file_content(max_length_path).format(table=table, schema_name=schema),
+                        vertica_conn_dict))
+
+
+@traced_check
+@cached_check('sql/DQ/select_columns_profile.sql')
+def profile_column_aggregates(dialect, schema, table, all_columns_list, text_columns_list, profile_checks,
+                              vertica_conn_dict, batch_size=100, where_clause='true'):
+    """
+    Один проход по таблице (или по пачке из batch_size колонок для широких таблиц) для проверок 2, 3, 4 и 8.
+    where_clause ограничивает строки, например новыми по tech_load_ts.
+
+    Возвращает {колонка: {'non_empty': кол-во непустых, 'max_len': макс. длина в байтах, 'not_utf8': 0/1}}.
+    """
+    need_length = 3 in profile_checks or 8 in profile_checks
+    aggregates = {col: {} for col in all_columns_list}
+    for start in range(0, len(all_columns_list), batch_size):
+        batch = all_columns_list[start:start + batch_size]
+        select_list = []
+        for i, col in enumerate(batch):
+            if 2 in profile_checks:
+                select_list.append(f"count(nullif(to_char({col}), '')) as nn_{i}")
+            if col in text_columns_list:
+                if need_length:
+                    select_list.append(f'max(octet_length({col})) as len_{i}')
+                if 4 in profile_checks:
+                    select_list.append(f'max(case when makeutf8(to_char({col})) <> to_char({col}) then 1 else 0 end)'
+                                       f' as bad_{i}')
+        if not select_list:
+            continue
+        script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_columns_profile.sql')).format(
+            table=table, schema=schema, select_list=',\n'.join(select_list), where_clause=where_clause)
+        row = iter(run_sql(dialect, script, vertica_conn_dict)[0])
+
+        for col in batch:
+            if 2 in profile_checks:
+                aggregates[col]['non_empty'] = next(row)
+            if col in text_columns_list:
+                if need_length:
+                    aggregates[col]['max_len'] = next(row)
+                if 4 in profile_checks:
+                    aggregates[col]['not_utf8'] = next(row) or 0
+    return aggregates
+
+
+def format_column_profile(aggregates, text_columns_list, char_max_length, profile_checks):
+    """Переводит агрегаты profile_column_aggregates в значения листа Detail."""
+    profile = {}
+    for col, col_aggregates in aggregates.items():
+        col_profile = {}
+        if 2 in profile_checks:
+            col_profile['null_cols'] = 1 if not col_aggregates.get('non_empty') else 0
+        if col in text_columns_list:
+            max_len = col_aggregates.get('max_len')
+            col_max = char_max_length.get(col)
+            if 3 in profile_checks:
+                reached = max_len is not None and col_max is not None and col_max <= max_len
+                col_profile['max_length'] = 1 if reached else 0
+            if 4 in profile_checks:
+                col_profile['not_utf8'] = 1 if col_aggregates.get('not_utf8') == 1 else 0
+            if 8 in profile_checks:
+                col_profile['length stat'] = None if max_len is None else f'Varchar({max_len}) из ({col_max})'
+        else:
+            col_profile.update({'max_length': '-', 'not_utf8': '-', 'length stat': '-'})
+        if col_profile.get('null_cols') == 1:
+            logging.warning(f'Весь столбец {col} пустой')
+        if col_profile.get('max_length') == 1:
+            logging.warning(f'{col} достигла максимальной длины')
+        if col_profile.get('not_utf8') == 1:
+            logging.warning(f'{col} В поле есть не UTF-8 символы')
+        profile[col] = col_profile
+    return profile
+
+
+def profile_columns(dialect, schema, table, all_columns_list, text_columns_list, profile_checks, vertica_conn_dict,
+                    batch_size=100, catalog=None):
+    """
+    Проверки 2, 3, 4 и 8 одним проходом по таблице (или по пачке из batch_size колонок для широких таблиц).
+
+    Возвращает словарь {колонка: {'null_cols', 'max_length', 'not_utf8', 'length stat'}} в том же виде,
+    в каком эти значения раньше попадали в лист Detail.
+    """
+    char_max_length = select_char_max_length(dialect, schema, table, vertica_conn_dict, catalog)
+    aggregates = profile_column_aggregates(dialect, schema, table, all_columns_list, text_columns_list,
+                                           profile_checks, vertica_conn_dict, batch_size=batch_size)
+    return format_column_profile(aggregates, text_columns_list, char_max_length, profile_checks)
+
+
+@traced_check
+@cached_check('sql/DQ/check_insert_new_rows_with_deleted.sql', 'sql/DQ/check_insert_new_rows_wo_deleted.sql')
+def check_insert_new_rows(dialect, schema, table, vertica_conn_dict, catalog=None):
     ods_schema = schema
     stg_schema = schema.replace('ODS_', 'STG_')
     if bool(run_sql(dialect, f'select 1 from {stg_schema}.{table} limit 1', vertica_conn_dict)):
-        select_pk_path = f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql'
-        select_pk_script = read_file_content(select_pk_path).format(table=table, schema_name=stg_schema)
-        pk_columns = run_sql(dialect, select_pk_script,
-                                 vertica_conn_dict)
-        pk_columns_list = to_flat_list(pk_columns)
+        pk_columns_list = select_pk_columns(dialect, stg_schema, table, vertica_conn_dict, catalog)
         pk_columns_str = ', '.join([f'{col}' for col in pk_columns_list])
         if pk_columns_str == '':
             logging.warning(f'Нет первичного ключа')
         else:
-            select_bc_path = f'{path}/sql/work_with_meta/vertica/select_business_columns.sql'
-            select_bc_script = read_file_content(select_bc_path).format(table=table, schema_name=stg_schema)
-            bc_columns = run_sql(dialect, select_bc_script, vertica_conn_dict)
-            bc_columns_list = to_flat_list(bc_columns)
+            bc_columns_list = select_business_columns(dialect, stg_schema, table, vertica_conn_dict, catalog)
             # формирование скрипта для измеенившихся строк пр. false or (stg.col1 <=> ods.col1) = false
             u_compare = 'False'
             for col in bc_columns_list:
@@ -142,9 +312,13 @@ def check_insert_new_rows(dialect, schema, table, vertica_conn_dict):
             for col in pk_columns_list:
                 pk_join = pk_join + f' and ods.{col} = stg.{col}'
 
-            if bool(run_sql(dialect, 
+            if catalog is not None and (ods_schema, table) in catalog:
+                has_deleted = 'tech_is_deleted' in catalog.columns(ods_schema, table)
+            else:
+                has_deleted = bool(run_sql(dialect,
                     f"""select 1 from columns where table_schema = \'{ods_schema}\' and table_name = \'{table}\' 
-                    and column_name = \'tech_is_deleted\'""", vertica_conn_dict)):
+                    and column_name = \'tech_is_deleted\'""", vertica_conn_dict))
+            if has_deleted:
                 check_insert_new_rows_path = f'{path}/sql/DQ/check_insert_new_rows_with_deleted.sql'
             else:
                 check_insert_new_rows_path = f'{path}/sql/DQ/check_insert_new_rows_wo_deleted.sql'
@@ -163,96 +337,207 @@ def check_insert_new_rows(dialect, schema, table, vertica_conn_dict):
                 logging.warning(f'Какая то хуйня')
                 print(check_insert_new_rows_script)
 
-def check_insert_new_rows(dialect, schema, table, vertica_conn_dict):
-    ods_schema = schema
-    stg_schema = schema.replace('ODS_', 'STG_')
-    if bool(run_sql(dialect, f'select 1 from {stg_schema}.{table} limit 1', vertica_conn_dict)):
-        select_pk_path = f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql'
-        select_pk_script = read_file_content(select_pk_path).format(table=table, schema_name=stg_schema)
-        pk_columns = run_sql(dialect, select_pk_script,
-                                 vertica_conn_dict)
-        pk_columns_list = to_flat_list(pk_columns)
-        pk_columns_str = ', '.join([f'{col}' for col in pk_columns_list])
-        if pk_columns_str == '':
-            logging.warning(f'Нет первичного ключа')
-        else:
-            select_bc_path = f'{path}/sql/work_with_meta/vertica/select_business_columns.sql'
-            select_bc_script = read_file_content(select_bc_path).format(table=table, schema_name=stg_schema)
-            bc_columns = run_sql(dialect, select_bc_script, vertica_conn_dict)
-            bc_columns_list = to_flat_list(bc_columns)
-            # формирование скрипта для измеенившихся строк пр. false or (stg.col1 <=> ods.col1) = false
-            u_compare = 'False'
-            for col in bc_columns_list:
-                u_compare = u_compare + f' or (ods.{col} <=> stg.{col}) = False'
+def read_increment_template(dialect, name):
+    return read_file_content(template_path(dialect, f'{path}/sql/DQ/increment', name))
 
-            e_compare = 'True'
-            for col in bc_columns_list:
-                e_compare = e_compare + f' and (ods.{col} <=> stg.{col})'
-
-            # формирование строчки для on в джойне пр. true and stg.pk1 = ods.pk1
-            pk_join = 'true'
-            for col in pk_columns_list:
-                pk_join = pk_join + f' and ods.{col} = stg.{col}'
-
-            if bool(run_sql(dialect, 
-                    f"""select 1 from columns where table_schema = \'{ods_schema}\' and table_name = \'{table}\' 
-                    and column_name = \'tech_is_deleted\'""", vertica_conn_dict)):
-                check_insert_new_rows_path = f'{path}/sql/DQ/check_insert_new_rows_with_deleted.sql'
-            else:
-                check_insert_new_rows_path = f'{path}/sql/DQ/check_insert_new_rows_wo_deleted.sql'
-            check_insert_new_rows_script = read_file_content(check_insert_new_rows_path).format(table=table,
-                                                                                                ods_schema=ods_schema,
-                                                                                                stg_schema=stg_schema,
-                                                                                                pk_join=pk_join,
-                                                                                                u_compare=u_compare,
-                                                                                                e_compare=e_compare,
-                                                                                                pk_columns_str=pk_columns_str)
 
-            result = to_flat_list(run_sql(dialect, check_insert_new_rows_script, vertica_conn_dict))
-            if result[0]:
-                logging.warning(f'Инкремент Возможно хороший')
-            else:
-                logging.warning(f'Какая то хуйня')
-                print(check_insert_new_rows_script)
+def increment_params(dialect, schema, table, vertica_conn_dict, catalog=None, compare_mode='columns',
+                     mismatch_limit=0):
+    """
+    Параметры шаблонов sql/DQ/increment для пары ODS/STG: границы загрузки STG, ключ, сравнение бизнес-колонок.
+    None - STG пустая или нет первичного ключа.
+    """
+    ods_schema = schema
+    stg_schema = schema.replace('ODS_', 'STG_')
 
-def check_segmentation(dialect, schema, table, vertica_conn_dict):
-    if bool(run_sql(dialect, f'select 1 from {schema}.{table} limit 1', vertica_conn_dict)):
-        select_pk_path = f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql'
-        select_pk_script = read_file_content(select_pk_path).format(table=table, schema_name=schema)
-        pk_columns = run_sql(dialect, select_pk_script,
-                                 vertica_conn_dict)
-        pk_columns_list = to_flat_list(pk_columns)
-        pk_columns_str = ', '.join([f'{col}' for col in pk_columns_list])
-        if pk_columns_str == '':
-            logging.warning(f'Нет первичного ключа')
+    stg_min_ts, stg_max_ts = run_sql(dialect, read_increment_template(dialect, 'select_stg_load_bounds.sql').format(
+        stg_schema=stg_schema, table=table), vertica_conn_dict)[0]
+    if stg_min_ts is None:
+        logging.warning(f'{stg_schema}.{table} пустая, инкремент не проверяется')
+        return None
+
+    pk_columns_list = select_pk_columns(dialect, stg_schema, table, vertica_conn_dict, catalog)
+    bk_columns_list = [col for col in pk_columns_list if col != 'tech_load_ts']
+    if not bk_columns_list:
+        logging.warning(f'Нет первичного ключа')
+        return None
+    bc_columns_list = select_business_columns(dialect, stg_schema, table, vertica_conn_dict, catalog)
+    if catalog is not None and (ods_schema, table) in catalog:
+        has_deleted = 'tech_is_deleted' in catalog.columns(ods_schema, table)
+    else:
+        has_deleted = bool(run_sql(dialect,
+                                   f"""select 1 from columns where table_schema = '{ods_schema}' 
+                                   and table_name = '{table}' and column_name = 'tech_is_deleted'""",
+                                   vertica_conn_dict))
+
+    bk_columns_str = ', '.join(bk_columns_list)
+    params = {
+        'table': table, 'ods_schema': ods_schema, 'stg_schema': stg_schema,
+        'stg_min_ts': stg_min_ts, 'stg_max_ts': stg_max_ts,
+        'bk_columns_str': bk_columns_str,
+        'stg_bk_columns': ', '.join(f'stg.{col}' for col in bk_columns_list),
+        'ods_bk_columns': ', '.join(f'ods.{col}' for col in bk_columns_list),
+        'pk_join': ' and '.join(['true'] + [f'ods.{col} = stg.{col}' for col in bk_columns_list]),
+        'update_deleted_filter': 'and ods.tech_is_deleted = 0' if has_deleted else '',
+        'limit': mismatch_limit,
+        'has_deleted': has_deleted,
+    }
+    if compare_mode == 'hash':
+        # Снимок хранит только ключ, tech-поля и один хэш бизнес-колонок - и меньше, и сравнивать проще
+        row_hash = f'HASH({", ".join(bc_columns_list)})' if bc_columns_list else '0'
+        tech_columns = 'tech_load_ts, tech_is_deleted' if has_deleted else 'tech_load_ts'
+        params['stg_snapshot_columns'] = f'{bk_columns_str}, tech_load_ts, {row_hash} as dq_row_hash'
+        params['ods_snapshot_columns'] = f'{bk_columns_str}, {tech_columns}, {row_hash} as dq_row_hash'
+        params['u_compare'] = 'ods.dq_row_hash <> stg.dq_row_hash'
+    else:
+        params['stg_snapshot_columns'] = '*'
+        params['ods_snapshot_columns'] = '*'
+        params['u_compare'] = ' or '.join(['False'] + [f'(ods.{col} {NULL_SAFE_EQUAL[dialect]} stg.{col}) = False'
+                                                       for col in bc_columns_list])
+    return params
+
+
+def increment_bucket_filter(params, buckets, bucket):
+    """Условие на строки части bucket из buckets для шаблонов sql/DQ/increment."""
+    return f'MOD(HASH({params["bk_columns_str"]}), {buckets}) = {bucket}' if buckets > 1 else 'true'
+
+
+@traced_check
+@cached_check('sql/DQ/increment/create_stg_snapshot.sql', 'sql/DQ/increment/create_ods_snapshot.sql',
+              'sql/DQ/increment/select_increment_counts_with_deleted.sql',
+              'sql/DQ/increment/select_increment_counts_wo_deleted.sql',
+              'sql/DQ/increment/select_update_mismatches.sql')
+def check_increment(dialect, schema, table, vertica_conn_dict, catalog=None, compare_mode='columns', buckets=1,
+                    state=None, mismatch_limit=0):
+    """
+    Проверка 6. Последние версии ключей STG и ODS (до начала инкремента) один раз сохраняются
+    во временные таблицы сессии, по ним считаются количества вставок, обновлений и удалений.
+    Инкремент корректен, если их сумма равна количеству актуальных строк ODS.
+
+    compare_mode='hash' - в снимки попадает один HASH по бизнес-колонкам вместо самих колонок,
+    и обновления ищутся сравнением хэшей. buckets > 1 - таблица проверяется частями по MOD(HASH(ключ), buckets),
+    готовые части сохраняются в state (StateStore) и при повторном запуске пропускаются.
+    mismatch_limit > 0 - если обновления есть, выбирается до mismatch_limit отличающихся ключей.
+
+    Возвращает {'inc_insert', 'inc_update', 'inc_delete', 'ods_actual', 'increment_ok', 'mismatch_keys'} или None,
+    если STG пустая или нет первичного ключа.
+    """
+    params = increment_params(dialect, schema, table, vertica_conn_dict, catalog, compare_mode, mismatch_limit)
+    if params is None:
+        return None
+    stg_min_ts, stg_max_ts, has_deleted = params['stg_min_ts'], params['stg_max_ts'], params['has_deleted']
+    bk_columns_str = params['bk_columns_str']
+
+    counts_template = ('select_increment_counts_with_deleted.sql' if has_deleted
+                       else 'select_increment_counts_wo_deleted.sql')
+    drop_statements = [statement for statement in read_increment_template(dialect, 'drop_snapshots.sql').split(';')
+                       if statement.strip()]
+
+    # Прогресс по бакетам действителен, пока не изменился инкремент в STG
+    progress_id = f'{stg_min_ts}/{stg_max_ts}/{buckets}/{compare_mode}'
+    progress = state.get(schema, table, 'increment_buckets') if state is not None and buckets > 1 else None
+    done = progress['done'] if progress and progress['id'] == progress_id else {}
+
+    totals = {'inc_insert': 0, 'inc_update': 0, 'inc_delete': None, 'ods_actual': 0}
+    mismatch_keys = []
+    for bucket in range(buckets):
+        if str(bucket) in done:
+            counts = done[str(bucket)]
         else:
-            check_pk_double_path = f'{path}/sql/DQ/check_segmentation.sql'
-            check_segmentation_script = read_file_content(check_pk_double_path).format(table=table, schema=schema,
-                                                                                       pk=pk_columns_str)
-
-            result = to_flat_list(run_sql(dialect, check_segmentation_script, vertica_conn_dict))
-            logging.warning(f'Уникальные проценты сегментации в нодах {result[0]}')
-            return result[0]
+            bucket_filter = increment_bucket_filter(params, buckets, bucket)
+            with sql_session(dialect, vertica_conn_dict) as run:
+                try:
+                    for statement in drop_statements:
+                        run(statement)
+                    run(read_increment_template(dialect, 'create_stg_snapshot.sql').format(
+                        bucket_filter=bucket_filter, **params))
+                    run(read_increment_template(dialect, 'create_ods_snapshot.sql').format(
+                        bucket_filter=bucket_filter, **params))
+                    counts = run(read_increment_template(dialect, counts_template).format(
+                        bucket_filter=bucket_filter, **params))[0]
+                    if counts[1] and len(mismatch_keys) < mismatch_limit:
+                        mismatch_keys.extend(run(read_increment_template(dialect, 'select_update_mismatches.sql')
+                                                 .format(bucket_filter=bucket_filter, **params)))
+                finally:
+                    for statement in drop_statements:
+                        run(statement)
+            if state is not None and buckets > 1:
+                done[str(bucket)] = list(counts)
+                state.set(schema, table, 'increment_buckets', {'id': progress_id, 'done': done})
+        inserted, updated, deleted, ods_actual = counts
+        totals['inc_insert'] += inserted
+        totals['inc_update'] += updated
+        totals['ods_actual'] += ods_actual
+        if deleted is not None:
+            totals['inc_delete'] = (totals['inc_delete'] or 0) + deleted
+
+    inserted, updated, deleted, ods_actual = (totals['inc_insert'], totals['inc_update'], totals['inc_delete'],
+                                              totals['ods_actual'])
+    totals['increment_ok'] = int(inserted + updated + (deleted or 0) == ods_actual)
+    if totals['increment_ok']:
+        logging.info(f'{schema}.{table}: инкремент корректен I={inserted} U={updated} D={deleted}')
     else:
-        return 'Пустая'
-
-
-def check_bussines_key_counts(dialect, schema, table, vertica_conn_dict):
-    select_pk_path = f'{path}/sql/work_with_meta/vertica/select_primary_key_columns.sql'
-    select_pk_script = (read_file_content(select_pk_path).
-                        format(table=table,
-                               schema_name=schema))
-
-    pk_columns = run_sql(dialect, select_pk_script,
-                             vertica_conn_dict)
-    if bool(pk_columns):
+        logging.warning(f'{schema}.{table}: инкремент не сходится I={inserted} U={updated} D={deleted}, '
+                        f'актуальных строк в ODS {ods_actual}')
+    if mismatch_keys:
+        logging.warning(f'{schema}.{table}: примеры ключей с изменившимися бизнес-колонками ({bk_columns_str}): '
+                        f'{mismatch_keys[:mismatch_limit]}')
+    totals['mismatch_keys'] = [list(key) for key in mismatch_keys[:mismatch_limit]]
+    return totals
+
+
+@traced_check
+def check_segmentation(dialect, schema, table, vertica_conn_dict, skew_threshold=1.2):
+    """
+    Проверка 9 по мете хранения (projection_storage), время не зависит от размера таблицы.
+    Перекос проекции - отношение строк на самой загруженной ноде к среднему по нодам (1 - равномерно).
+    Возвращает перекос самой неравномерной сегментированной проекции, ее доли строк по нодам
+    и строки листа Segmentation (проекция x нода).
+    """
+    script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_segmentation_storage.sql')).format(
+        schema=schema, table=table)
+    projections = {}
+    for projection, is_segmented, node, row_count, used_bytes in run_sql(dialect, script, vertica_conn_dict):
+        projections.setdefault((projection, bool(is_segmented)), []).append((node, row_count, used_bytes))
+
+    def skew(values):
+        total = sum(values)
+        return round(max(values) * len(values) / total, 3) if total else None
+
+    rows = []
+    worst = {'skew': None, 'segmentation': None}
+    for (projection, is_segmented), nodes in projections.items():
+        row_skew = skew([row_count for _, row_count, _ in nodes]) if is_segmented else None
+        bytes_skew = skew([used_bytes for _, _, used_bytes in nodes]) if is_segmented else None
+        total_rows = sum(row_count for _, row_count, _ in nodes)
+        for node, row_count, used_bytes in nodes:
+            rows.append({'schema': schema, 'table': table, 'projection': projection, 'segmented': int(is_segmented),
+                         'node': node, 'rows': row_count, 'bytes': used_bytes,
+                         'rows_pct': round(row_count * 100 / total_rows, 2) if total_rows else None,
+                         'skew': row_skew, 'bytes_skew': bytes_skew,
+                         'alert': int(row_skew is not None and row_skew > skew_threshold)})
+        if row_skew is not None and (worst['skew'] is None or row_skew > worst['skew']):
+            # Как раньше в отчете: уникальные проценты строк по нодам
+            percents = sorted({int(row_count * 100 / total_rows) for _, row_count, _ in nodes})
+            worst = {'skew': row_skew, 'segmentation': ''.join(f'{percent}% ' for percent in percents)}
+
+    if worst['skew'] is not None and worst['skew'] > skew_threshold:
+        logging.warning(f'{schema}.{table}: перекос сегментации {worst["skew"]} больше {skew_threshold}')
+    logging.info(f'Уникальные проценты сегментации в нодах {worst["segmentation"]}')
+    return {**worst, 'rows': rows}
+
+
+@traced_check
+@cached_check('sql/DQ/check_bussines_key_counts.sql')
+def check_bussines_key_counts(dialect, schema, table, vertica_conn_dict, catalog=None):
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    if bool(pk_columns_list):
         logging.info('Первичный ключ есть')
-        pk_columns_list = to_flat_list(pk_columns)
         pk_columns_str = ', '.join([f'{col}' for col in pk_columns_list])
         print(pk_columns_str)
         pk_columns_str_wo_ts = pk_columns_str.replace(', tech_load_ts','')
         print(pk_columns_str_wo_ts)
-        check_pk_double_path = f'{path}/sql/DQ/check_bussines_key_counts.sql'
+        check_pk_double_path = template_path(dialect, f'{path}/sql/DQ/check_bussines_key_counts.sql')
         check_pk_script = read_file_content(check_pk_double_path).format(table=table, schema=schema, pk=pk_columns_str_wo_ts)
 
         result = to_flat_list(run_sql(dialect, check_pk_script, vertica_conn_dict))
@@ -261,6 +546,84 @@ def check_bussines_key_counts(dialect, schema, table, vertica_conn_dict):
     else:
         logging.warning(f'Первичного ключа нет')
 
+@traced_check
+@cached_check('sql/DQ/select_key_profile.sql')
+def check_key_profile(dialect, schema, table, vertica_conn_dict, catalog=None):
+    """
+    Проверки 1, 11, 12 за одно чтение таблицы: количество строк, ключей, дублей по ключу
+    и бизнес-ключей (ключ без tech_load_ts).
+    Без первичного ключа считается только количество строк.
+    """
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    if not pk_columns_list:
+        logging.warning(f'Первичного ключа нет')
+        return {'row_count': check_row_count(dialect, schema, table, vertica_conn_dict)[0],
+                'pk_count': None, 'pk_doubles': None, 'bk_count': None}
+
+    # Ключ только из tech_load_ts: бизнес-ключ - весь ключ, bk_count = pk_count
+    bk_columns_list = [col for col in pk_columns_list if col != 'tech_load_ts'] or pk_columns_list
+    key_profile_script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_key_profile.sql')).format(
+        table=table, schema=schema, pk=', '.join(pk_columns_list), bk=', '.join(bk_columns_list))
+    row_cnt, pk_cnt, dup_cnt, group_cnt = run_sql(dialect, key_profile_script, vertica_conn_dict)[0]
+    # У пустой таблицы суммы - NULL
+    profile = {'row_count': row_cnt or 0, 'pk_count': pk_cnt or 0, 'pk_doubles': dup_cnt or 0, 'bk_count': group_cnt}
+
+    if profile['pk_doubles']:
+        logging.warning(f"{profile['pk_doubles']} шт дублей по ключу в {schema}.{table}!!!!")
+    return profile
+
+
+def approximate_value(value, error_percent):
+    # Оценочные значения помечаются в отчете погрешностью
+    return f'~{value} ±{error_percent:g}%'
+
+
+@traced_check
+@cached_check('sql/DQ/select_key_profile_approximate.sql')
+def check_key_profile_approximate(dialect, schema, table, vertica_conn_dict, catalog=None, error_tolerance=1.25):
+    """
+    Приближенные проверки 11 и 12 через APPROXIMATE_COUNT_DISTINCT, без GROUP BY по ключу.
+    Количество строк точное, количество ключей и бизнес-ключей - оценка с погрешностью error_tolerance %.
+    """
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    if not pk_columns_list:
+        logging.warning(f'Первичного ключа нет')
+        return {'row_count': check_row_count(dialect, schema, table, vertica_conn_dict)[0],
+                'pk_count': None, 'pk_doubles': None, 'bk_count': None}
+    bk_columns_list = [col for col in pk_columns_list if col != 'tech_load_ts'] or pk_columns_list
+    script = read_file_content(template_path(dialect, f'{path}/sql/DQ/select_key_profile_approximate.sql')).format(
+        table=table, schema=schema, pk=', '.join(pk_columns_list), bk=', '.join(bk_columns_list),
+        error_tolerance=error_tolerance)
+    row_count, pk_count, bk_count = run_sql(dialect, script, vertica_conn_dict)[0]
+    return {'row_count': row_count,
+            'pk_count': approximate_value(pk_count, error_tolerance),
+            'pk_doubles': None,
+            'bk_count': approximate_value(bk_count, error_tolerance)}
+
+
+@traced_check
+@cached_check('sql/DQ/select_most_consistent_value_sampled.sql')
+def check_most_consistent_value_sampled(dialect, schema, table, column, vertica_conn_dict, sample_percent=1):
+    """
+    Приближенная проверка 7 по выборке TABLESAMPLE. Доля самого частого значения дается
+    с 95% доверительным интервалом, количества пересчитаны на всю таблицу.
+    """
+    script = read_file_content(
+        template_path(dialect, f'{path}/sql/DQ/select_most_consistent_value_sampled.sql')).format(
+        table=table, schema=schema, column=column, sample_percent=sample_percent)
+    result = run_sql(dialect, script, vertica_conn_dict)
+    if not result:
+        return [[None]]
+    value, cnt, sample_cnt = result[0]
+    share = cnt / sample_cnt
+    bound = 1.96 * math.sqrt(share * (1 - share) / sample_cnt) * 100
+    scale = 100 / sample_percent
+    result_str = (f"'{value}' ~{round(cnt * scale)} из ~{round(sample_cnt * scale)} "
+                  f"({share * 100:.2f} % ±{bound:.2f}%)")
+    logging.warning(f'{column} {result_str} ')
+    return [[result_str]]
+
+
 """def main_check(dialect, schema, table, all_columns_list, check_list, connection):
     check_type = 'all_col'
     for check in check_list:
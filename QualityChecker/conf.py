@@ -1,3 +1,5 @@
+# Кроме host можно указать "hosts": [список нод кластера] - сессии распределяются по нодам, при падении ноды
+# открываются на следующей, - и/или "discover_nodes": true - взять работающие ноды из v_catalog.nodes.
 vertica_conn_dict = {
     "DEV": {
         "host": "",
@@ -22,4 +24,21 @@ vertica_conn_dict = {
 
     }
 
-}
\ No newline at end of file
+}
+
+# Настройки параллельного запуска по средам. Подбирать под ресурсный пул Vertica:
+# table_workers - сколько таблиц проверяется одновременно, check_workers - сколько проверок одной таблицы.
+run_conf = {
+    "DEV": {
+        "table_workers": 4,
+        "check_workers": 2
+    },
+    "TEST": {
+        "table_workers": 4,
+        "check_workers": 2
+    },
+    "PROD": {
+        "table_workers": 2,
+        "check_workers": 2
+    }
+}
@@ -0,0 +1,283 @@
+"""
+Режим службы: проверки таблицы запускаются сразу после окончания ее загрузки.
+
+Загрузчик (или локальная заглушка: python .\\daemon.py --env DEV --signal ODS_CRM.CLIENT) кладет в папку spool
+файл-сигнал с именем схема.таблица[.что угодно]. Служба держит открытыми соединения и мету таблиц,
+забирает сигналы в ограниченную очередь и проверяет не больше workers таблиц одновременно:
+- повторные сигналы по таблице, которая уже ждет в очереди, склеиваются в одну проверку;
+- сигнал по таблице, которая сейчас проверяется, ставит ее на одну повторную проверку после текущей;
+- когда в очереди max_queue таблиц, новые сигналы не забираются и ждут в spool (обратное давление).
+Результаты дописываются в журнал reports/<среда>_daemon_<дата> и в историю метрик.
+В инкрементальном режиме (incremental, increment_buckets > 1) водяные знаки хранятся в state/<среда>_state.sqlite,
+общем с main.py: каждая проверка по сигналу смотрит только строки, загруженные после прошлой проверки таблицы.
+
+Запуск: python .\\daemon.py --env DEV --checks 1,5,10,11
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from api import DEFAULT_SETTINGS, build_context, path
+from conf import vertica_conn_dict, run_conf
+from runner import check_table
+from trends import find_anomalies
+from utils.catalog import load_catalog, load_storage
+from utils.databaseTools import configure_pool, close_pools
+from utils.history import HistoryStore
+from utils.report import ReportSink
+from utils.state import StateStore
+
+
+def send_signal(spool_dir, schema, table):
+    """Кладет сигнал об окончании загрузки schema.table. Файл появляется в spool целиком (через .tmp)."""
+    os.makedirs(spool_dir, exist_ok=True)
+    signal_path = os.path.join(spool_dir, f'{schema}.{table}.{time.time_ns()}')
+    with open(f'{signal_path}.tmp', 'w', encoding='utf8') as f:
+        f.write(time.strftime('%Y-%m-%d %H:%M:%S'))
+    os.replace(f'{signal_path}.tmp', signal_path)
+    return signal_path
+
+
+def _parse_signal(name):
+    parts = name.split('.')
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0], parts[1]
+
+
+class SignalQueue:
+    """
+    Ограниченная очередь таблиц из сигналов папки spool_dir.
+
+    Забранный сигнал переносится в spool_dir/processing и удаляется после проверки таблицы
+    (при ошибке - переносится в spool_dir/failed). Сигналы, забранные до падения службы, при старте
+    возвращаются в spool и проверяются заново.
+    """
+
+    def __init__(self, spool_dir, max_size=100):
+        self.spool_dir = spool_dir
+        self.max_size = max_size
+        self.processing_dir = os.path.join(spool_dir, 'processing')
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self._pending = OrderedDict()
+        self._running = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.processing_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+        for name in os.listdir(self.processing_dir):
+            os.replace(os.path.join(self.processing_dir, name), os.path.join(spool_dir, name))
+
+    def poll(self):
+        """
+        Забирает новые сигналы, пока в очереди есть место. Возвращает количество забранных сигналов.
+        Сигнал, который удалили или забрал другой процесс, пока его забирали, пропускается.
+        """
+        signals = []
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        signals.append((entry.stat().st_mtime, entry.name, entry.path))
+                except OSError as error:
+                    logging.warning(f'Сигнал {entry.path} пропущен: {error!r}')
+        claimed = 0
+        for _, name, signal_path in sorted(signals):
+            schema_table = _parse_signal(name)
+            if schema_table is None:
+                logging.warning(f'Не сигнал: {signal_path}')
+                try:
+                    os.replace(signal_path, os.path.join(self.failed_dir, name))
+                except OSError as error:
+                    logging.warning(f'Не удалось перенести {signal_path} в failed: {error!r}')
+                continue
+            key = (schema_table[0].lower(), schema_table[1].lower())
+            with self._lock:
+                if key not in self._pending and len(self._pending) >= self.max_size:
+                    # Очередь полна: остальные сигналы ждут в spool
+                    break
+                processing_path = os.path.join(self.processing_dir, name)
+                try:
+                    os.replace(signal_path, processing_path)
+                except OSError as error:
+                    logging.warning(f'Сигнал {signal_path} пропущен: {error!r}')
+                    continue
+                self._pending.setdefault(key, {'key': key, 'schema': schema_table[0], 'table': schema_table[1],
+                                               'files': []})
+                self._pending[key]['files'].append(processing_path)
+            claimed += 1
+        return claimed
+
+    def take(self):
+        """Первая таблица очереди, которая сейчас не проверяется, или None."""
+        with self._lock:
+            for key in self._pending:
+                if key not in self._running:
+                    self._running.add(key)
+                    return self._pending.pop(key)
+        return None
+
+    def done(self, item, failed=False):
+        with self._lock:
+            self._running.discard(item['key'])
+        for file in item['files']:
+            try:
+                if failed:
+                    os.replace(file, os.path.join(self.failed_dir, os.path.basename(file)))
+                else:
+                    os.remove(file)
+            except OSError as error:
+                logging.warning(f'Не удалось убрать сигнал {file}: {error!r}')
+
+    def size(self):
+        with self._lock:
+            return len(self._pending)
+
+
+class CatalogCache:
+    """Мета таблиц службы: грузится при первом сигнале по таблице и перечитывается раз в ttl секунд."""
+
+    def __init__(self, dialect, connection, catalog_first=False, ttl=3600):
+        self.dialect = dialect
+        self.connection = connection
+        self.catalog_first = catalog_first
+        self.ttl = ttl
+        self._catalogs = {}
+        self._lock = threading.Lock()
+
+    def get(self, schema, table):
+        key = (schema.lower(), table.lower())
+        with self._lock:
+            catalog, loaded_at = self._catalogs.get(key, (None, 0))
+        if catalog is None or time.time() - loaded_at > self.ttl:
+            catalog = load_catalog(self.dialect, path, [(schema, table)], self.connection,
+                                   catalog_first=self.catalog_first)
+            with self._lock:
+                self._catalogs[key] = (catalog, time.time())
+        elif self.catalog_first:
+            # После загрузки количество строк в мете хранения другое
+            load_storage(self.dialect, path, [(schema, table)], self.connection, catalog)
+        return catalog
+
+
+class DailyReports:
+    """Журнал службы: новая папка reports/<среда>_daemon_<дата> на каждый день."""
+
+    def __init__(self, env):
+        self.env = env
+        self._reports = {}
+        self._lock = threading.Lock()
+
+    def today(self):
+        day = time.strftime('%Y-%m-%d')
+        with self._lock:
+            if day not in self._reports:
+                self._reports[day] = ReportSink(f'{path}/reports/{self.env}_daemon_{day}')
+            return self._reports[day]
+
+
+def _check_signal(env, item, checks, settings, catalogs, check_workers, reports, history, state=None):
+    schema, table = item['schema'], item['table']
+    connection = vertica_conn_dict[env]
+    ctx = build_context(env, connection, checks, catalogs.get(schema, table), settings, check_workers, state=state)
+    result = check_table(ctx, schema, table)
+    if result is None:
+        logging.warning(f'{env}: {schema}.{table} пустая')
+        return
+    general_row, detail_rows, sheets = result
+    report = reports.today()
+    report.write('General', [general_row])
+    report.write('Detail', detail_rows)
+    for sheet, rows in sheets.items():
+        report.write(sheet, rows)
+    if history:
+        # Каждая проверка таблицы - отдельный запуск истории, аномалии считаются сразу по ней
+        store = HistoryStore(f'{path}/history/{env}_history.sqlite', env,
+                             run_id=f'{time.strftime("%Y%m%d%H%M%S")}_{schema}.{table}')
+        try:
+            store.append([general_row])
+            store.append(detail_rows)
+            anomalies = find_anomalies(store, settings['history_depth'], settings['anomaly_change_threshold'])
+        finally:
+            store.close()
+        for anomaly in anomalies:
+            logging.warning(f'{env}: аномалия {anomaly}')
+        report.write('Anomalies', anomalies)
+
+
+def serve(env, spool_dir, checks=None, settings=None, workers=2, max_queue=100, poll_interval=5, catalog_ttl=3600,
+          history=True, stop=None):
+    """
+    Работает, пока не выставлен stop (threading.Event) или не нажат Ctrl+C. Уже начатые проверки доделываются.
+    QueryMemo и трасса в службе не используются: результаты запросов устаревают с каждой загрузкой.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    checks = list(checks if checks is not None else settings['checks'])
+    connection = vertica_conn_dict[env]
+    check_workers = run_conf.get(env, {}).get('check_workers', 1)
+    # Соединения остаются открытыми между проверками: одновременно до workers * check_workers сессий
+    configure_pool(connection, max_size=workers * check_workers, dialect=settings['dialect'])
+    queue = SignalQueue(spool_dir, max_queue)
+    catalogs = CatalogCache(settings['dialect'], connection, settings['catalog_first'], catalog_ttl)
+    reports = DailyReports(env)
+    state = None
+    if settings['incremental'] or settings['increment_buckets'] > 1:
+        state = StateStore(f'{path}/state/{env}_state.sqlite')
+    stop = stop or threading.Event()
+    running = {}
+    print(f'{env}: служба проверок слушает {spool_dir}')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not stop.is_set() or running:
+            try:
+                if not stop.is_set():
+                    try:
+                        queue.poll()
+                    except OSError as error:
+                        # Например, spool временно недоступен: служба продолжает работу и смотрит снова
+                        logging.error(f'{env}: не удалось прочитать {spool_dir}: {error!r}')
+                    while len(running) < workers:
+                        item = queue.take()
+                        if item is None:
+                            break
+                        print(f'{env}: проверка {item["schema"]}.{item["table"]}, сигналов {len(item["files"])}, '
+                              f'в очереди {queue.size()}')
+                        running[executor.submit(_check_signal, env, item, checks, settings, catalogs,
+                                                check_workers, reports, history, state)] = item
+                if not running:
+                    stop.wait(poll_interval)
+                    continue
+                finished, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logging.error(f'{env}: проверка {item["schema"]}.{item["table"]} упала: {error!r}')
+                    queue.done(item, failed=error is not None)
+            except KeyboardInterrupt:
+                print(f'{env}: остановка, доделываем {len(running)} проверок')
+                stop.set()
+    if state is not None:
+        state.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Служба проверок таблиц по сигналам об окончании загрузки')
+    parser.add_argument('--env', default='DEV', help='среда из conf.py')
+    parser.add_argument('--spool', default=None, help='папка сигналов, по умолчанию spool/<среда>')
+    parser.add_argument('--checks', default=','.join(map(str, DEFAULT_SETTINGS['checks'])),
+                        help='номера проверок через запятую')
+    parser.add_argument('--workers', type=int, default=2, help='сколько таблиц проверять одновременно')
+    parser.add_argument('--max-queue', type=int, default=100, help='сколько таблиц может ждать в очереди')
+    parser.add_argument('--poll-interval', type=float, default=5, help='как часто смотреть spool, секунд')
+    parser.add_argument('--signal', default=None, help='положить сигнал схема.таблица и выйти (заглушка загрузчика)')
+    args = parser.parse_args()
+    spool = args.spool or f'{path}/spool/{args.env}'
+    if args.signal:
+        print(send_signal(spool, *args.signal.split('.', 1)))
+    else:
+        serve(args.env, spool, [int(check) for check in args.checks.split(',')], workers=args.workers,
+              max_queue=args.max_queue, poll_interval=args.poll_interval)
+        close_pools()
@@ -0,0 +1,47 @@
+"""
+Сводный отчет запуска по нескольким средам: одни и те же схема.таблица на DEV, TEST, PROD рядом.
+
+General diff - строка на таблицу: количество строк и ключей, max tech_load_ts и счетчики проверок каждой среды
+в соседних колонках, в differs - метрики, значения которых в средах не совпадают.
+Detail diff - только колонки, флаги которых (пустая, не utf-8, достигнута длина) различаются между средами.
+"""
+GENERAL_METRICS = ['stg_row_count', 'ods_row_count', 'bk_counts', 'max_ts_ods', 'max_ts_stg', 'ods_pk_doubles',
+                   'stg_pk_doubles', 'ods_null_fields', 'ods_max_length', 'ods_not_utf8', 'increment_ok']
+DETAIL_METRICS = ['null_cols', 'not_utf8', 'max_length']
+# Таблицы нет в списке проверок среды или она пустая
+MISSING_VALUE = 'Нет'
+
+
+def _index(rows, key_fields):
+    return {tuple(str(row[field]).lower() for field in key_fields): row for row in rows}
+
+
+def _diff(env_rows, key_fields, metrics, only_differences):
+    envs = list(env_rows)
+    indexed = {env: _index(rows, key_fields) for env, rows in env_rows.items()}
+    keys = sorted(set().union(*(rows.keys() for rows in indexed.values())))
+    # Колонки одинаковые у всех строк: метрики, которые есть хотя бы в одной среде
+    metrics = [metric for metric in metrics if any(metric in row for rows in env_rows.values() for row in rows)]
+    diff_rows = []
+    for key in keys:
+        source = next(indexed[env][key] for env in envs if key in indexed[env])
+        row = {field: source[field] for field in key_fields}
+        differs = []
+        for metric in metrics:
+            values = [indexed[env][key].get(metric) if key in indexed[env] else MISSING_VALUE for env in envs]
+            row.update({f'{metric} {env}': value for env, value in zip(envs, values)})
+            if len({str(value) for value in values}) > 1:
+                differs.append(metric)
+        if differs or not only_differences:
+            row['differs'] = ', '.join(differs)
+            diff_rows.append(row)
+    return diff_rows
+
+
+def diff_environments(results):
+    """results - {среда: (строки General, строки Detail)}. Возвращает строки листов General diff и Detail diff."""
+    general = _diff({env: rows[0] for env, rows in results.items()}, ('schema', 'table'), GENERAL_METRICS,
+                    only_differences=False)
+    detail = _diff({env: rows[1] for env, rows in results.items()}, ('schema', 'table', 'column'), DETAIL_METRICS,
+                   only_differences=True)
+    return general, detail
@@ -0,0 +1,117 @@
+"""
+Выгрузка строк-доказательств для проверок 1, 4, 6 и 13 (utils.evidence.EvidenceSink).
+
+Запускается после проверок таблицы и только для тех проверок, которые нашли проблему.
+Запросы ограничены row_cap строк и читаются пачками, результат пишется в Parquet рядом с отчетом.
+"""
+import logging
+
+from checks import path, select_pk_columns, increment_params, increment_bucket_filter, read_increment_template
+from utils.databaseTools import sql_session, template_path
+from utils.utils import read_file_content
+
+
+def _evidence_template(dialect, name):
+    return read_file_content(template_path(dialect, f'{path}/sql/DQ/evidence', name))
+
+
+def export_pk_doubles(dialect, schema, table, vertica_conn_dict, sink, check, catalog=None):
+    """Проверки 1 (ODS) и 13 (STG): все строки с повторяющимся ключом."""
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    if not pk_columns_list:
+        return None
+    script = _evidence_template(dialect, 'select_pk_double_rows.sql').format(
+        schema=schema, table=table, pk=', '.join(pk_columns_list),
+        pk_join=' and '.join(f't.{col} = d.{col}' for col in pk_columns_list), row_cap=sink.row_cap)
+    with sql_session(dialect, vertica_conn_dict) as run:
+        return sink.write(schema, table, check, run.stream(script, sink.batch_size))
+
+
+def export_not_utf8(dialect, schema, table, columns, vertica_conn_dict, sink, catalog=None):
+    """Проверка 4: ключ строки и значения колонок columns, в которых есть не utf-8 символы."""
+    pk_columns_list = select_pk_columns(dialect, schema, table, vertica_conn_dict, catalog)
+    select_list = pk_columns_list + [f'makeutf8(to_char({col})) as {col}' for col in columns
+                                     if col not in pk_columns_list]
+    condition = ' or '.join(f'makeutf8(to_char({col})) <> to_char({col})' for col in columns)
+    script = _evidence_template(dialect, 'select_not_utf8_rows.sql').format(
+        schema=schema, table=table, select_list=', '.join(select_list), condition=condition, row_cap=sink.row_cap)
+    with sql_session(dialect, vertica_conn_dict) as run:
+        return sink.write(schema, table, 4, run.stream(script, sink.batch_size))
+
+
+def export_increment(dialect, schema, table, vertica_conn_dict, sink, catalog=None, compare_mode='columns',
+                     buckets=1):
+    """
+    Проверка 6: ключи вставок, обновлений и удалений по тем же снимкам, что и в check_increment.
+    При buckets > 1 снимки строятся по частям, как в check_increment; выгрузка останавливается на row_cap строк.
+    """
+    params = increment_params(dialect, schema, table, vertica_conn_dict, catalog, compare_mode)
+    if params is None:
+        return None
+    has_deleted = params['has_deleted']
+    params.update({
+        'insert_deleted_filter': 'or ods.tech_is_deleted = 1' if has_deleted else '',
+        # Без tech_is_deleted удаления не считаются, как и в check_increment
+        'delete_deleted_filter': 'and ods.tech_is_deleted = 0' if has_deleted else 'and false',
+    })
+    drop_statements = [statement for statement in read_increment_template(dialect, 'drop_snapshots.sql').split(';')
+                       if statement.strip()]
+
+    def batches():
+        rows = 0
+        for bucket in range(buckets):
+            if rows >= sink.row_cap:
+                break
+            bucket_params = dict(params, bucket_filter=increment_bucket_filter(params, buckets, bucket),
+                                 row_cap=sink.row_cap - rows)
+            with sql_session(dialect, vertica_conn_dict) as run:
+                try:
+                    for statement in drop_statements:
+                        run(statement)
+                    run(read_increment_template(dialect, 'create_stg_snapshot.sql').format(**bucket_params))
+                    run(read_increment_template(dialect, 'create_ods_snapshot.sql').format(**bucket_params))
+                    script = _evidence_template(dialect, 'select_increment_diff_rows.sql').format(**bucket_params)
+                    stream = run.stream(script, sink.batch_size)
+                    # Имена колонок - один раз, из первой части
+                    columns = next(stream)
+                    if bucket == 0:
+                        yield columns
+                    for batch in stream:
+                        rows += len(batch)
+                        yield batch
+                finally:
+                    for statement in drop_statements:
+                        run(statement)
+
+    return sink.write(schema, table, 6, batches())
+
+
+def _found(value):
+    # Оценки ('~...'), ошибки и таймауты не выгружаем
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def export_evidence(ctx, schema, table, general, detail):
+    """Выгружает строки по проверкам таблицы, которые нашли проблему. Ошибка выгрузки не влияет на отчет."""
+    stg_schema = schema.replace('ODS_', 'STG_')
+    exports = []
+    if 1 in ctx.checks and _found(general.get('ods_pk_doubles')):
+        exports.append((1, lambda: export_pk_doubles(ctx.dialect, schema, table, ctx.connection, ctx.evidence, 1,
+                                                     ctx.catalog)))
+    if 13 in ctx.checks and _found(general.get('stg_pk_doubles')):
+        exports.append((13, lambda: export_pk_doubles(ctx.dialect, stg_schema, table, ctx.connection, ctx.evidence,
+                                                      13, ctx.catalog)))
+    bad_columns = [col for col, values in detail.items() if values.get('not_utf8') == 1]
+    if 4 in ctx.checks and bad_columns:
+        exports.append((4, lambda: export_not_utf8(ctx.dialect, schema, table, bad_columns, ctx.connection,
+                                                   ctx.evidence, ctx.catalog)))
+    if 6 in ctx.checks and general.get('increment_ok') == 0:
+        exports.append((6, lambda: export_increment(ctx.dialect, schema, table, ctx.connection, ctx.evidence,
+                                                    ctx.catalog, compare_mode=ctx.compare_mode,
+                                                    buckets=ctx.increment_buckets)))
+    for check, export in exports:
+        try:
+            rows = export()
+            logging.info(f'{schema}.{table}: по проверке {check} выгружено строк: {rows}')
+        except Exception:
+            logging.exception(f'{schema}.{table}: не удалось выгрузить строки по проверке {check}')
@@ -0,0 +1,443 @@
+import datetime
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from checks import check_increment, check_segmentation, check_value_distribution, format_value_distribution, \
+    check_max_tech_load_ts, check_key_profile, check_key_profile_approximate, check_most_consistent_value_sampled, \
+    check_row_count, profile_column_aggregates, format_column_profile, select_char_max_length, path
+from evidence import export_evidence
+from incremental import incremental_profile, incremental_pk_doubles
+from utils.cache import get_result_cache
+from utils.catalog import load_storage
+from utils.databaseTools import run_sql, query_time_limit, QueryTimeout
+from utils.trace import get_tracer, trace_context
+from utils.utils import to_flat_list
+
+# Колонки листа General и номер проверки, которая их заполняет (порядок колонок в отчете)
+GENERAL_COLUMNS = {
+    'ods_pk_doubles': 1,
+    'stg_pk_doubles': 13,
+    'ods_row_count': 11,
+    'stg_row_count': 10,
+    'bk_counts': 12,
+    'max_ts_ods': 5,
+    'max_ts_stg': 14,
+    'ods_null_fields': 2,
+    'ods_max_length': 3,
+    'ods_not_utf8': 4,
+    'segmentation': 9,
+    'segmentation_skew': 9,
+    'inc_insert': 6,
+    'inc_update': 6,
+    'inc_delete': 6,
+    'ods_actual': 6,
+    'increment_ok': 6,
+}
+
+# Колонки листа Detail и номер проверки, которая их заполняет
+DETAIL_COLUMNS = {
+    'null_cols': 2,
+    'not_utf8': 4,
+    'max_length': 3,
+    'Consist': 7,
+    'length stat': 8
+}
+
+# Ключ, под которым задача проверки 9 передает строки листа Segmentation
+SEGMENTATION_ROWS = 'segmentation_rows'
+
+ERROR_VALUE = 'Ошибка'
+# Проверка не уложилась в бюджет времени и более дешевого варианта нет
+TIMEOUT_VALUE = 'Таймаут'
+# Проверка не запускалась: истекает срок всего запуска
+SKIPPED_VALUE = 'Пропущено'
+
+
+class RunContext:
+    """Все, что нужно проверкам одной таблицы: среда, список проверок, мета и настройки параллельности."""
+
+    def __init__(self, dialect, connection, checks, catalog, profile_batch_size=100, check_workers=1, state=None,
+                 incremental=False,
+                 approximate=False, sample_percent=1, approximate_error=1.25, exact_columns=(),
+                 compare_mode='columns', increment_buckets=1, mismatch_limit=0, governor=None,
+                 evidence=None, catalog_first=False, analyze_max_age=24 * 3600, analyze_limit=None,
+                 catalog_max_age=600, skew_threshold=1.2, env=None, checkpoint=None, top_k=5, max_distinct=100000,
+                 distribution_batch_size=20):
+        self.dialect = dialect
+        self.connection = connection
+        self.checks = checks
+        self.catalog = catalog
+        self.profile_batch_size = profile_batch_size
+        self.check_workers = check_workers
+        # StateStore для состояния между запусками: водяные знаки инкрементального режима и прогресс проверки 6
+        self.state = state
+        self.incremental = incremental and state is not None
+        # Приближенный режим для проверок 7, 11, 12. exact_columns - 'схема.таблица.колонка', которые
+        # нужно пересчитать точно (например, подозрительные по прошлому отчету)
+        self.approximate = approximate
+        self.sample_percent = sample_percent
+        self.approximate_error = approximate_error
+        self.exact_columns = {col.lower() for col in exact_columns}
+        # Проверка 6: сравнение по колонкам или по хэшу, количество бакетов и сколько отличающихся ключей выбирать
+        self.compare_mode = compare_mode
+        self.increment_buckets = increment_buckets
+        self.mismatch_limit = mismatch_limit
+        # TimeGovernor с бюджетами времени на проверку, таблицу и весь запуск. None - без ограничений
+        self.governor = governor
+        # EvidenceSink для выгрузки строк по проверкам 1, 4, 6, 13, которые нашли проблему. None - без выгрузки
+        self.evidence = evidence
+        # Режим catalog-first: количество строк (проверки 10, 11) и пустота таблицы берутся из меты хранения,
+        # analyze_statistics запускается только для таблиц со статистикой старше analyze_max_age секунд и не больше
+        # analyze_limit раз за запуск. Мета старше catalog_max_age секунд перед проверкой таблицы перечитывается
+        self.catalog_first = catalog_first
+        self.analyze_max_age = analyze_max_age
+        self.analyze_limit = analyze_limit
+        self.catalog_max_age = catalog_max_age
+        self._analyzed = 0
+        self._analyze_lock = threading.Lock()
+        # Проверка 9: перекос сегментации (строки на самой загруженной ноде к среднему), выше которого нужна тревога
+        self.skew_threshold = skew_threshold
+        # Проверка 7: сколько частых значений показывать, выше какого количества различных значений top не считать
+        # и сколько колонок считать одним запросом
+        self.top_k = top_k
+        self.max_distinct = max_distinct
+        self.distribution_batch_size = distribution_batch_size
+        # Имя среды из conf.py: попадает в трассу, чтобы замеры разных сред запуска не смешивались
+        self.env = env
+        # CheckpointJournal: результат каждой задачи сразу пишется в журнал, при продолжении запуска готовые задачи
+        # берутся из него. None - без журнала
+        self.checkpoint = checkpoint
+
+    def storage_row_count(self, schema, table):
+        """Точное количество строк из меты хранения в режиме catalog-first, иначе None."""
+        return self.catalog.exact_row_count(schema, table) if self.catalog_first else None
+
+    def needs_analyze(self, schema, table):
+        if not self.catalog_first:
+            return True
+        storage = self.catalog.storage(schema, table)
+        if storage is not None and not storage['columns_without_statistics'] \
+                and _age(storage['statistics_updated']) < self.analyze_max_age:
+            return False
+        with self._analyze_lock:
+            if self.analyze_limit is not None and self._analyzed >= self.analyze_limit:
+                return False
+            self._analyzed += 1
+        return True
+
+    def is_exact(self, schema, table, column=None):
+        if not self.approximate:
+            return True
+        # 'схема.таблица' в exact_columns включает точный расчет и для всех колонок таблицы
+        if f'{schema}.{table}'.lower() in self.exact_columns:
+            return True
+        return column is not None and f'{schema}.{table}.{column}'.lower() in self.exact_columns
+
+
+def _age(timestamp):
+    """Сколько секунд прошло с timestamp. Неизвестное время считается бесконечно старым."""
+    if not isinstance(timestamp, datetime.datetime):
+        return float('inf')
+    return (datetime.datetime.now(timestamp.tzinfo) - timestamp).total_seconds()
+
+
+def stg_schema_name(schema):
+    return schema.replace('ODS_', 'STG_')
+
+
+def _key_profile_ods(ctx, schema, table, columns):
+    if ctx.incremental and not any(check in ctx.checks for check in (11, 12)):
+        print(f'{schema}.{table}: 1. Проверка дублей по ключу по новым строкам')
+        return {'ods_pk_doubles': incremental_pk_doubles(ctx.dialect, schema, table, ctx.connection, ctx.state,
+                                                         ctx.catalog)}, {}
+    if not ctx.is_exact(schema, table) and 1 not in ctx.checks:
+        print(f'{schema}.{table}: 11, 12. Приближенное количество строк и бизнес ключей ODS')
+        profile = check_key_profile_approximate(ctx.dialect, schema, table, ctx.connection, ctx.catalog,
+                                                error_tolerance=ctx.approximate_error)
+        return {'ods_row_count': profile['row_count'], 'bk_counts': profile['bk_count']}, {}
+    if not any(check in ctx.checks for check in (1, 12)):
+        # Ключи не нужны: количество строк по мете хранения, без нее - count(1) без группировки по ключу
+        row_count = ctx.storage_row_count(schema, table)
+        if row_count is not None:
+            print(f'{schema}.{table}: 11. Количество строк ODS по мете хранения')
+            return {'ods_row_count': row_count}, {}
+        print(f'{schema}.{table}: 11. Количество строк ODS')
+        return {'ods_row_count': check_row_count(ctx.dialect, schema, table, ctx.connection)[0]}, {}
+    print(f'{schema}.{table}: 1, 11, 12. Ключи и количество строк ODS одним проходом')
+    profile = check_key_profile(ctx.dialect, schema, table, ctx.connection, ctx.catalog)
+    return {'ods_pk_doubles': profile['pk_doubles'], 'ods_row_count': profile['row_count'],
+            'bk_counts': profile['bk_count']}, {}
+
+
+def _key_profile_stg(ctx, schema, table, columns):
+    if 13 not in ctx.checks:
+        row_count = ctx.storage_row_count(stg_schema_name(schema), table)
+        if row_count is not None:
+            print(f'{schema}.{table}: 10. Количество строк STG по мете хранения')
+            return {'stg_row_count': row_count}, {}
+        print(f'{schema}.{table}: 10. Количество строк STG')
+        return {'stg_row_count': check_row_count(ctx.dialect, stg_schema_name(schema), table, ctx.connection)[0]}, {}
+    print(f'{schema}.{table}: 10, 13. Ключи и количество строк STG одним проходом')
+    profile = check_key_profile(ctx.dialect, stg_schema_name(schema), table, ctx.connection, ctx.catalog)
+    return {'stg_pk_doubles': profile['pk_doubles'], 'stg_row_count': profile['row_count']}, {}
+
+
+def _segmentation(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 9. Перекос сегментации по мете хранения')
+    result = check_segmentation(ctx.dialect, schema, table, ctx.connection, skew_threshold=ctx.skew_threshold)
+    # Строки листа Segmentation _check_table забирает из General
+    return {'segmentation': result['segmentation'], 'segmentation_skew': result['skew'],
+            SEGMENTATION_ROWS: result['rows']}, {}
+
+
+def _profile(ctx, schema, table, columns):
+    profile_checks = [check for check in (2, 3, 4, 8) if check in ctx.checks]
+    print(f'{schema}.{table}: {", ".join(map(str, profile_checks))}. Профиль колонок одним проходом')
+    text_columns = ctx.catalog.text_columns(schema, table)
+    if ctx.incremental and 'tech_load_ts' in columns:
+        aggregates = incremental_profile(ctx.dialect, schema, table, columns, text_columns, profile_checks,
+                                         ctx.connection, ctx.state, batch_size=ctx.profile_batch_size)
+    else:
+        aggregates = profile_column_aggregates(ctx.dialect, schema, table, columns, text_columns, profile_checks,
+                                               ctx.connection, batch_size=ctx.profile_batch_size)
+    char_max_length = select_char_max_length(ctx.dialect, schema, table, ctx.connection, ctx.catalog)
+    profile = format_column_profile(aggregates, text_columns, char_max_length, profile_checks)
+    general = {
+        'ods_null_fields': sum(1 for col in columns if profile[col].get('null_cols') == 1),
+        'ods_max_length': sum(1 for col in columns if profile[col].get('max_length') == 1),
+        'ods_not_utf8': sum(1 for col in columns if profile[col].get('not_utf8') == 1),
+    }
+    return general, profile
+
+
+def _max_ts_ods(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 5. Максимальная tech_load_ts ODS')
+    return {'max_ts_ods': check_max_tech_load_ts(ctx.dialect, schema, table, ctx.connection)[0]}, {}
+
+
+def _increment(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 6. Проверка корректности инкремента')
+    result = check_increment(ctx.dialect, schema, table, ctx.connection, ctx.catalog, compare_mode=ctx.compare_mode,
+                             buckets=ctx.increment_buckets, state=ctx.state, mismatch_limit=ctx.mismatch_limit)
+    return result or {}, {}
+
+
+def _most_consistent_value(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 7. Распределение значений, top {ctx.top_k} по колонке')
+    detail = {}
+    exact_columns = [col for col in columns if ctx.is_exact(schema, table, col)]
+    distribution = check_value_distribution(ctx.dialect, schema, table, exact_columns, ctx.connection,
+                                            top_k=ctx.top_k, max_distinct=ctx.max_distinct,
+                                            batch_size=ctx.distribution_batch_size)
+    for col in columns:
+        if col in distribution:
+            value = format_value_distribution(distribution[col])
+        else:
+            value = to_flat_list(check_most_consistent_value_sampled(ctx.dialect, schema, table, col, ctx.connection,
+                                                                     sample_percent=ctx.sample_percent))[0]
+        detail[col] = {'Consist': value}
+    return {}, detail
+
+
+def _key_profile_ods_fallback(ctx, schema, table, columns):
+    if not any(check in ctx.checks for check in (11, 12)):
+        return {}, {}
+    print(f'{schema}.{table}: 11, 12. Таймаут, считаем приближенно')
+    profile = check_key_profile_approximate(ctx.dialect, schema, table, ctx.connection, ctx.catalog,
+                                            error_tolerance=ctx.approximate_error)
+    return {'ods_row_count': profile['row_count'], 'bk_counts': profile['bk_count']}, {}
+
+
+def _increment_fallback(ctx, schema, table, columns):
+    if ctx.compare_mode == 'hash':
+        return {}, {}
+    print(f'{schema}.{table}: 6. Таймаут, сравниваем по хэшу строк')
+    result = check_increment(ctx.dialect, schema, table, ctx.connection, ctx.catalog, compare_mode='hash',
+                             buckets=ctx.increment_buckets, state=ctx.state, mismatch_limit=ctx.mismatch_limit)
+    return result or {}, {}
+
+
+def _most_consistent_value_fallback(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 7. Таймаут, считаем по выборке {ctx.sample_percent} % строк')
+    detail = {}
+    for col in columns:
+        value = to_flat_list(check_most_consistent_value_sampled(ctx.dialect, schema, table, col, ctx.connection,
+                                                                 sample_percent=ctx.sample_percent))[0]
+        detail[col] = {'Consist': value}
+    return {}, detail
+
+
+def _max_ts_stg(ctx, schema, table, columns):
+    print(f'{schema}.{table}: 14. Максимальная tech_load_ts STG')
+    stg_schema = stg_schema_name(schema)
+    return {'max_ts_stg': check_max_tech_load_ts(ctx.dialect, stg_schema, table, ctx.connection)[0]}, {}
+
+
+# Независимые друг от друга задачи по таблице: (номера проверок, функция).
+# Функция возвращает (значения для General, {колонка: значения для Detail}).
+TASKS = [
+    ((1, 11, 12), _key_profile_ods),
+    ((9,), _segmentation),
+    ((10, 13), _key_profile_stg),
+    ((2, 3, 4, 8), _profile),
+    ((5,), _max_ts_ods),
+    ((6,), _increment),
+    ((7,), _most_consistent_value),
+    ((14,), _max_ts_stg),
+]
+
+# Более дешевые варианты задач на случай таймаута. Что вариант не посчитал, помечается TIMEOUT_VALUE
+FALLBACKS = {
+    _key_profile_ods: _key_profile_ods_fallback,
+    _increment: _increment_fallback,
+    _most_consistent_value: _most_consistent_value_fallback,
+}
+
+
+def _mark(task_checks, columns, value, result=None):
+    """Заполняет value все поля задачи, которых нет в result."""
+    general, detail = result or ({}, {})
+    general = dict(general)
+    general.update({key: value for key, check in GENERAL_COLUMNS.items() if check in task_checks
+                    and key not in general})
+    detail_keys = [key for key, check in DETAIL_COLUMNS.items() if check in task_checks]
+    detail = {col: dict(detail.get(col, {})) for col in columns}
+    for col in columns:
+        detail[col].update({key: value for key in detail_keys if key not in detail[col]})
+    return general, detail
+
+
+def _run_with_limit(ctx, task_checks, func, schema, table, columns, table_deadline):
+    governor = ctx.governor
+    limit = None if governor is None else governor.task_limit(task_checks, table_deadline)
+    tracer = get_tracer()
+    with query_time_limit(limit), trace_context(env=ctx.env, schema=schema, table=table,
+                                                check=','.join(map(str, task_checks))):
+        if tracer is None:
+            return func(ctx, schema, table, columns)
+        with tracer.measure('task', function=func.__name__):
+            return func(ctx, schema, table, columns)
+
+
+def _run_task(ctx, task, schema, table, columns, table_deadline=None):
+    """Возвращает (статус задачи: 'ok', 'timeout', 'error' или 'skipped', результат задачи)."""
+    task_checks, func = task
+    if ctx.governor is not None and ctx.governor.should_skip(task_checks):
+        logging.warning(f'{schema}.{table}: проверки {task_checks} пропущены, заканчивается время запуска')
+        return 'skipped', _mark(task_checks, columns, SKIPPED_VALUE)
+    try:
+        return 'ok', _run_with_limit(ctx, task_checks, func, schema, table, columns, table_deadline)
+    except QueryTimeout:
+        logging.warning(f'{schema}.{table}: проверки {task_checks} не уложились в отведенное время')
+    except Exception:
+        logging.error(f'{schema}.{table}: ошибка в проверках {task_checks}:\n{traceback.format_exc()}')
+        return 'error', _mark(task_checks, columns, ERROR_VALUE)
+
+    fallback = FALLBACKS.get(func)
+    if fallback is None:
+        return 'timeout', _mark(task_checks, columns, TIMEOUT_VALUE)
+    try:
+        result = _run_with_limit(ctx, task_checks, fallback, schema, table, columns, table_deadline)
+    except QueryTimeout:
+        logging.warning(f'{schema}.{table}: упрощенный вариант проверок {task_checks} тоже не уложился')
+        result = None
+    except Exception:
+        logging.error(f'{schema}.{table}: ошибка в упрощенных проверках {task_checks}:\n{traceback.format_exc()}')
+        return 'error', _mark(task_checks, columns, ERROR_VALUE)
+    return 'timeout', _mark(task_checks, columns, TIMEOUT_VALUE, result)
+
+
+def _run_task_checkpointed(ctx, task, schema, table, columns, table_deadline=None):
+    status, result = _run_task(ctx, task, schema, table, columns, table_deadline)
+    if ctx.checkpoint is not None:
+        ctx.checkpoint.record_task(schema, table, task[1].__name__, ctx.checks, status, result)
+    return result
+
+
+def check_table(ctx, schema, table):
+    """
+    Выполняет выбранные проверки по одной таблице.
+    Возвращает (строка листа General, строки листа Detail, {лист: строки} остальных листов)
+    или None, если таблица пустая.
+    """
+    tracer = get_tracer()
+    with trace_context(env=ctx.env, schema=schema, table=table):
+        if tracer is None:
+            return _check_table(ctx, schema, table)
+        with tracer.measure('table'):
+            return _check_table(ctx, schema, table)
+
+
+def _check_table(ctx, schema, table):
+    print(f'Начало проверки таблицы  {schema}.{table}  select analyze_statistics(\'{schema}.{table}\')')
+    print(time.strftime("%Y-%m-%d %H:%M"))
+    governor = ctx.governor
+    table_deadline = None if governor is None else governor.table_deadline()
+    columns = ctx.catalog.columns(schema, table)
+    tasks = [task for task in TASKS if any(check in ctx.checks for check in task[0])]
+    checkpoint = ctx.checkpoint
+    restored = []
+    if checkpoint is not None:
+        if checkpoint.is_empty(schema, table, ctx.checks):
+            logging.warning(f'Таблица {schema}.{table} пустая (по журналу прогресса)')
+            return None
+        restored = [checkpoint.task_result(schema, table, task[1].__name__, ctx.checks) for task in tasks]
+        tasks = [task for task, result in zip(tasks, restored) if result is None]
+        restored = [result for result in restored if result is not None]
+        if restored:
+            print(f'{schema}.{table}: задач взято из журнала прогресса: {len(restored)}, осталось: {len(tasks)}')
+
+    if tasks and (governor is None or not governor.run_expired()):
+        storage = ctx.catalog.storage(schema, table) if ctx.catalog_first else None
+        if storage is not None and time.time() - storage['loaded_at'] > ctx.catalog_max_age:
+            load_storage(ctx.dialect, path, [(schema, table)], ctx.connection, ctx.catalog)
+        if ctx.needs_analyze(schema, table):
+            try:
+                with query_time_limit(None if governor is None else governor.task_limit((), table_deadline)):
+                    run_sql(ctx.dialect, f'select analyze_statistics(\'{schema}.{table}\')', ctx.connection)
+            except QueryTimeout:
+                logging.warning(f'{schema}.{table}: analyze_statistics не уложился в отведенное время, '
+                                f'продолжаем без него')
+        else:
+            logging.info(f'{schema}.{table}: analyze_statistics пропущен, статистика свежая или исчерпан лимит')
+
+        row_count = ctx.storage_row_count(schema, table)
+        if row_count == 0 or (row_count is None and not bool(
+                run_sql(ctx.dialect, f'select 1 from {schema}.{table} limit 1', ctx.connection))):
+            logging.warning(f'Таблица {schema}.{table} пустая')
+            if checkpoint is not None:
+                checkpoint.record_empty(schema, table, ctx.checks)
+            return None
+    if governor is not None:
+        # Низкоприоритетные задачи ставим в конец очереди, чтобы при нехватке времени пропускались именно они
+        tasks.sort(key=lambda task: governor.is_low_priority(task[0]))
+    with ThreadPoolExecutor(max_workers=max(1, ctx.check_workers)) as executor:
+        results = list(executor.map(lambda task: _run_task_checkpointed(ctx, task, schema, table, columns,
+                                                                        table_deadline), tasks))
+
+    general = {}
+    detail = {col: {} for col in columns}
+    for task_general, task_detail in restored + results:
+        general.update(task_general)
+        for col, values in task_detail.items():
+            detail.setdefault(col, {}).update(values)
+
+    if ctx.evidence is not None and tasks and (governor is None or not governor.run_expired()):
+        export_evidence(ctx, schema, table, general, detail)
+
+    sheets = {'Segmentation': general.pop(SEGMENTATION_ROWS, None) or []}
+    general_row = {'schema': schema, 'table': table}
+    general_row.update({key: general.get(key) for key, check in GENERAL_COLUMNS.items() if check in ctx.checks})
+    if get_result_cache(ctx.connection) is not None:
+        # Сколько результатов по таблице взято из кэша прошлых запусков
+        general_row['cache_hits'] = get_result_cache(ctx.connection).hits(schema, table)
+    detail_rows = []
+    for col in columns:
+        detail_row = {'schema': schema, 'table': table, 'column': col}
+        detail_row.update({key: detail[col].get(key) for key, check in DETAIL_COLUMNS.items() if check in ctx.checks})
+        detail_rows.append(detail_row)
+    print(f'Конец проверки таблицы  {schema}.{table}  {time.strftime("%Y-%m-%d %H:%M")}')
+    return general_row, detail_rows, sheets
@@ -2,6 +2,7 @@ select count(1)
 from (
 select {pk}
 from {schema}.{table}
+where {where_clause}
 group by {pk}
 having count(1) >1
 ) q
\ No newline at end of file
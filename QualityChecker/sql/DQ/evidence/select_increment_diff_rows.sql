@@ -0,0 +1,19 @@
+-- Ключи, которые дают вставки, обновления и удаления проверки 6. Читает снимки dq_stg_snapshot и dq_ods_snapshot
+select 'insert' as change_type, {stg_bk_columns}
+from dq_stg_snapshot as stg
+left join dq_ods_snapshot as ods
+on {pk_join}
+where (ods.tech_load_ts is null {insert_deleted_filter})
+union all
+select 'update' as change_type, {stg_bk_columns}
+from dq_stg_snapshot as stg
+inner join dq_ods_snapshot as ods
+on {pk_join}
+where ( {u_compare} ) {update_deleted_filter}
+union all
+select 'delete' as change_type, {ods_bk_columns}
+from dq_ods_snapshot as ods
+left join dq_stg_snapshot as stg
+on {pk_join}
+where stg.tech_load_ts is null {delete_deleted_filter}
+limit {row_cap};
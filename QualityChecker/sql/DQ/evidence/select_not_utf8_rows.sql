@@ -0,0 +1,5 @@
+-- Ключи строк и значения колонок с не utf-8 символами (проверка 4). Значения приведены MAKEUTF8
+select {select_list}
+from {schema}.{table}
+where {condition}
+limit {row_cap};
@@ -0,0 +1,9 @@
+-- Строки с повторяющимся первичным ключом (проверки 1, 13)
+select t.*
+from {schema}.{table} t
+join (select {pk}
+      from {schema}.{table}
+      group by {pk}
+      having count(1) > 1) d
+on {pk_join}
+limit {row_cap};
@@ -0,0 +1,7 @@
+-- Последняя версия каждого ключа в ODS до начала текущего инкремента
+CREATE LOCAL TEMPORARY TABLE dq_ods_snapshot ON COMMIT PRESERVE ROWS AS
+SELECT {ods_snapshot_columns}
+FROM {ods_schema}.{table}
+WHERE tech_load_ts < '{stg_min_ts}'
+AND {bucket_filter}
+LIMIT 1 OVER (PARTITION BY {bk_columns_str} ORDER BY tech_load_ts DESC);
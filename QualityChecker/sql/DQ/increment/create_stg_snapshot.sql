@@ -0,0 +1,6 @@
+-- Последняя версия каждого ключа в STG. Строится один раз за проверку (или за бакет) и живет до конца сессии
+CREATE LOCAL TEMPORARY TABLE dq_stg_snapshot ON COMMIT PRESERVE ROWS AS
+SELECT {stg_snapshot_columns}
+FROM {stg_schema}.{table}
+WHERE {bucket_filter}
+LIMIT 1 OVER (PARTITION BY {bk_columns_str} ORDER BY tech_load_ts DESC);
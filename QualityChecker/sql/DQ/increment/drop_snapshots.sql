@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS dq_stg_snapshot;
+DROP TABLE IF EXISTS dq_ods_snapshot;
@@ -0,0 +1,16 @@
+select
+(select count(1) from dq_stg_snapshot as stg
+ left join dq_ods_snapshot as ods
+ on {pk_join}
+ where ods.tech_load_ts is null or ods.tech_is_deleted = 1) as i,
+(select count(1) from dq_stg_snapshot as stg
+ inner join dq_ods_snapshot as ods
+ on {pk_join}
+ where ( {u_compare} ) and ods.tech_is_deleted = 0) as u,
+(select count(1) from dq_ods_snapshot as ods
+ left join dq_stg_snapshot as stg
+ on {pk_join}
+ where stg.tech_load_ts is null and ods.tech_is_deleted = 0) as d,
+(select count(1) from {ods_schema}.{table}
+ where tech_load_ts >= '{stg_max_ts}'
+ and {bucket_filter}) as ods_actual;
@@ -0,0 +1,13 @@
+select
+(select count(1) from dq_stg_snapshot as stg
+ left join dq_ods_snapshot as ods
+ on {pk_join}
+ where ods.tech_load_ts is null) as i,
+(select count(1) from dq_stg_snapshot as stg
+ inner join dq_ods_snapshot as ods
+ on {pk_join}
+ where ( {u_compare} )) as u,
+null as d,
+(select count(1) from {ods_schema}.{table}
+ where tech_load_ts >= '{stg_max_ts}'
+ and {bucket_filter}) as ods_actual;
@@ -0,0 +1,2 @@
+select min(tech_load_ts), max(tech_load_ts)
+from {stg_schema}.{table};
@@ -0,0 +1,7 @@
+-- Ключи, у которых отличаются бизнес-колонки. Выбирается только если обновления есть
+select {stg_bk_columns}
+from dq_stg_snapshot as stg
+inner join dq_ods_snapshot as ods
+on {pk_join}
+where ( {u_compare} ) {update_deleted_filter}
+limit {limit};
@@ -0,0 +1,4 @@
+SELECT
+{select_list}
+FROM {schema}.{table}
+WHERE {where_clause};
@@ -0,0 +1,17 @@
+-- Проверки 1, 11, 12 (и 10, 13 для STG) за одно чтение таблицы:
+-- pk_level - одна строка на ключ, bk_level - группировка ключей по бизнес-ключу
+with pk_level as (
+select {bk},
+       count(1) as cnt
+from {schema}.{table}
+group by {pk}
+),
+bk_level as (
+select count(1) as pk_cnt,
+       sum(cnt) as row_cnt,
+       sum(case when cnt > 1 then 1 else 0 end) as dup_cnt
+from pk_level
+group by {bk}
+)
+select sum(row_cnt), sum(pk_cnt), sum(dup_cnt), count(1)
+from bk_level;
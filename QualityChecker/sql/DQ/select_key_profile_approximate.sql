@@ -0,0 +1,5 @@
+-- Приближенный вариант проверок 11, 12: без GROUP BY по ключу, ошибка задается error_tolerance (%)
+select count(1),
+       APPROXIMATE_COUNT_DISTINCT(HASH({pk}), {error_tolerance}),
+       APPROXIMATE_COUNT_DISTINCT(HASH({bk}), {error_tolerance})
+from {schema}.{table};
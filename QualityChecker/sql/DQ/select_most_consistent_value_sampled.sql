@@ -0,0 +1,9 @@
+-- Приближенный вариант проверки 7 по выборке sample_percent % строк.
+-- Всего строк в выборке считается окном, чтобы выборка читалась один раз
+select nvl(to_char({column}),'NULL') as col,
+       count(1) as cnt,
+       sum(count(1)) over () as sample_cnt
+from {schema}.{table} TABLESAMPLE({sample_percent})
+group by {column}
+order by 2 desc
+limit 1;
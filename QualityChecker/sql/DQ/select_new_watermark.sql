@@ -0,0 +1,3 @@
+select max(tech_load_ts)
+from {schema}.{table}
+where {where_clause};
@@ -0,0 +1,14 @@
+-- Проверка 9 по мете хранения: строки и байты каждой проекции таблицы на каждой ноде, без чтения таблицы.
+-- Ноды без данных проекции попадают в результат с нулями. Берутся только работающие ноды с данными:
+-- нули DOWN-нод и нод без данных (STANDBY, EPHEMERAL, EXECUTE) завысили бы перекос
+SELECT p.projection_name, p.is_segmented, n.node_name, nvl(ps.row_count, 0), nvl(ps.used_bytes, 0)
+FROM projections p
+CROSS JOIN nodes n
+LEFT JOIN projection_storage ps
+ON ps.projection_id = p.projection_id
+AND ps.node_name = n.node_name
+WHERE p.projection_schema ilike '{schema}'
+AND p.anchor_table_name ilike '{table}'
+AND n.node_state = 'UP'
+AND n.node_type = 'PERMANENT'
+ORDER BY p.projection_name, n.node_name;
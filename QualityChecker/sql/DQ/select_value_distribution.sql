@@ -0,0 +1,19 @@
+-- Проверка 7: top {top_k} значений нескольких колонок одним проходом по таблице (GROUPING SETS).
+-- col_num - номер колонки в пачке. NULL и пустые строки в top не входят, их считает первый проход
+with grouped as (
+    select {column_case} as col_num,
+           {value_case} as value,
+           count(1) as cnt
+    from (select {value_list}
+          from {schema}.{table}) v
+    group by grouping sets ({grouping_sets})
+), ranked as (
+    select col_num, value, cnt,
+           row_number() over (partition by col_num order by cnt desc, value) as rn
+    from grouped
+    where nvl(value, '') <> ''
+)
+select col_num, value, cnt
+from ranked
+where rn <= {top_k}
+order by col_num, rn;
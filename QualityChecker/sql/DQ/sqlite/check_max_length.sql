@@ -0,0 +1,8 @@
+select (select character_maximum_length
+from columns
+where 
+data_type like '%char%'
+and lower(table_schema) = lower('{schema}')
+and lower(table_name) = lower('{table}')
+and lower(column_name) = lower('{column}')) <=
+       (select max(bit_length({column}))/8 from {schema}.{table})
@@ -0,0 +1,8 @@
+-- Вариант для SQLite: LIMIT 1 OVER заменен на row_number(), временная таблица живет до конца соединения
+CREATE TEMP TABLE dq_ods_snapshot AS
+SELECT {ods_snapshot_columns}
+FROM (SELECT *, row_number() OVER (PARTITION BY {bk_columns_str} ORDER BY tech_load_ts DESC) as dq_rn
+      FROM {ods_schema}.{table}
+      WHERE tech_load_ts < '{stg_min_ts}'
+      AND {bucket_filter})
+WHERE dq_rn = 1;
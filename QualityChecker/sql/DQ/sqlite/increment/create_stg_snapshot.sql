@@ -0,0 +1,7 @@
+-- Вариант для SQLite: LIMIT 1 OVER заменен на row_number(), временная таблица живет до конца соединения
+CREATE TEMP TABLE dq_stg_snapshot AS
+SELECT {stg_snapshot_columns}
+FROM (SELECT *, row_number() OVER (PARTITION BY {bk_columns_str} ORDER BY tech_load_ts DESC) as dq_rn
+      FROM {stg_schema}.{table}
+      WHERE {bucket_filter})
+WHERE dq_rn = 1;
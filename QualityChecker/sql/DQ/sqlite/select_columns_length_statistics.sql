@@ -0,0 +1,11 @@
+with column_length as
+(select character_maximum_length
+from columns
+where 
+data_type like '%char%'
+and lower(table_schema) = lower('{schema}')
+and lower(table_name) = lower('{table}')
+and lower(column_name) = lower('{column}')),
+max_length as (select max(bit_length({column}))/8  max_length from {schema}.{table})
+
+select 'Varchar('|| cast(max_length as integer) || ') из (' || character_maximum_length ||')' from max_length,column_length
@@ -0,0 +1,9 @@
+-- Вариант для SQLite: TABLESAMPLE нет, выборка sample_percent % строк через random()
+select nvl(to_char({column}),'NULL') as col,
+       count(1) as cnt,
+       sum(count(1)) over () as sample_cnt
+from {schema}.{table}
+where abs(random() % 1000000) < {sample_percent} * 10000
+group by {column}
+order by 2 desc
+limit 1;
@@ -0,0 +1,5 @@
+-- Вариант для SQLite: одна "нода" и одна проекция на таблицу
+SELECT anchor_table_name || '_super', 1, 'node0001', row_count, used_bytes
+FROM projection_storage
+WHERE lower(anchor_table_schema) = lower('{schema}')
+AND lower(anchor_table_name) = lower('{table}');
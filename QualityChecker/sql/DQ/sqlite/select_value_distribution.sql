@@ -0,0 +1,13 @@
+-- Вариант для SQLite: GROUPING SETS нет, группировки по колонкам объединяются через UNION ALL
+with grouped as (
+{union_list}
+), ranked as (
+    select col_num, value, cnt,
+           row_number() over (partition by col_num order by cnt desc, value) as rn
+    from grouped
+    where nvl(value, '') <> ''
+)
+select col_num, value, cnt
+from ranked
+where rn <= {top_k}
+order by col_num, rn;
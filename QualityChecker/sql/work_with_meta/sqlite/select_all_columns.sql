@@ -0,0 +1,8 @@
+SELECT c.column_name 
+FROM columns c
+WHERE 
+{where_clause}
+and 
+lower(c.table_name) = lower('{table}')
+AND lower(c.table_schema) = lower('{schema_name}')
+ORDER BY c.ordinal_position;
@@ -0,0 +1,8 @@
+SELECT c.column_name, c.character_maximum_length
+FROM columns c
+WHERE 
+c.data_type like '%char%'
+and 
+lower(c.table_name) = lower('{table}')
+AND lower(c.table_schema) = lower('{schema_name}')
+ORDER BY c.ordinal_position;
@@ -0,0 +1,6 @@
+SELECT
+column_name
+FROM primary_keys 
+    WHERE lower(table_name) = lower('{table}')
+	AND lower(table_schema) = lower('{schema_name}')
+ORDER BY ordinal_position;
@@ -0,0 +1,5 @@
+-- Вариант для SQLite: меты хранения нет, отпечаток - количество строк и максимальный rowid
+SELECT
+(SELECT count(1) || '/' || max(rowid)
+ FROM {schema_name}.{table}),
+0;
@@ -0,0 +1,5 @@
+-- Вариант для SQLite: количество строк из представления projection_storage, статистики колонок нет
+SELECT anchor_table_schema, anchor_table_name, row_count, null, 0
+FROM projection_storage
+WHERE lower(anchor_table_schema) in ({schema_list})
+AND lower(anchor_table_name) in ({table_list});
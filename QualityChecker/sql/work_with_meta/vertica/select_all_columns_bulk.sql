@@ -0,0 +1,4 @@
+SELECT c.table_schema, c.table_name, c.column_name, c.data_type, c.character_maximum_length
+FROM columns c
+WHERE lower(c.table_schema) in ({schema_list})
+ORDER BY c.table_schema, c.table_name, c.ordinal_position;
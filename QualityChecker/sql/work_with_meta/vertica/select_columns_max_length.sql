@@ -0,0 +1,8 @@
+SELECT c.column_name, c.character_maximum_length
+FROM columns c
+WHERE 
+c.data_type ilike '%char%'
+and 
+c.table_name ilike '{table}'
+AND c.table_schema ilike '{schema_name}'
+ORDER BY c.ordinal_position;
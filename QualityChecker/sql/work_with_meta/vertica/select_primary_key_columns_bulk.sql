@@ -0,0 +1,4 @@
+SELECT table_schema, table_name, column_name
+FROM primary_keys
+WHERE lower(table_schema) in ({schema_list})
+ORDER BY table_schema, table_name, ordinal_position;
@@ -0,0 +1,12 @@
+-- Стоимость запросов запуска на сервере по LABEL-меткам (см. utils/trace.py)
+select r.request_label,
+       max(r.request_duration_ms) as request_duration_ms,
+       sum(p.counter_value) as execution_time_us,
+       max(r.memory_acquired_mb) as memory_acquired_mb
+from v_monitor.query_requests r
+left join v_monitor.execution_engine_profiles p
+    on p.transaction_id = r.transaction_id
+    and p.statement_id = r.statement_id
+    and p.counter_name = 'execution time (us)'
+where r.request_label in ({label_list})
+group by r.request_label
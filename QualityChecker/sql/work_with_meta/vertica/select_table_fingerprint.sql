@@ -0,0 +1,13 @@
+-- Дешевый отпечаток изменений таблицы по мете хранения: меняется при загрузке, удалении и mergeout
+SELECT
+(SELECT sum(row_count) || '/' || sum(used_bytes) || '/' || sum(ros_count)
+ FROM projection_storage
+ WHERE anchor_table_schema ilike '{schema_name}'
+ AND anchor_table_name ilike '{table}'),
+(SELECT nvl(sum(dv.deleted_row_count), 0)
+ FROM delete_vectors dv
+ JOIN projections p
+ ON p.projection_schema = dv.schema_name
+ AND p.projection_name = dv.projection_name
+ WHERE p.projection_schema ilike '{schema_name}'
+ AND p.anchor_table_name ilike '{table}');
@@ -0,0 +1,4 @@
+SELECT anchor_table_schema, anchor_table_name, sum(row_count)
+FROM projection_storage
+WHERE lower(anchor_table_schema) in ({schema_list})
+GROUP BY anchor_table_schema, anchor_table_name;
@@ -0,0 +1,40 @@
+-- Мета хранения для режима catalog-first.
+-- Количество строк - по актуальной супер-проекции за вычетом удаленных строк (delete_vectors); у несегментированной
+-- проекции копия есть на каждой ноде. Время статистики - самый старый analyze_statistics среди колонок таблицы.
+WITH projection_rows AS (
+    SELECT p.projection_schema AS schema_name, p.anchor_table_name AS table_name, p.projection_name,
+           p.is_up_to_date, p.is_segmented,
+           sum(ps.row_count) AS row_count, count(DISTINCT ps.node_name) AS nodes
+    FROM projections p
+    JOIN projection_storage ps
+    ON ps.projection_id = p.projection_id
+    WHERE p.is_super_projection
+    AND lower(p.projection_schema) in ({schema_list})
+    AND lower(p.anchor_table_name) in ({table_list})
+    GROUP BY 1, 2, 3, 4, 5
+), deleted AS (
+    SELECT schema_name, projection_name, sum(deleted_row_count) AS deleted_rows
+    FROM delete_vectors
+    WHERE lower(schema_name) in ({schema_list})
+    GROUP BY 1, 2
+), column_statistics AS (
+    SELECT table_schema, table_name, min(statistics_updated_timestamp) AS statistics_updated,
+           sum(CASE WHEN statistics_type = 'FULL' THEN 0 ELSE 1 END) AS columns_without_statistics
+    FROM projection_columns
+    WHERE lower(table_schema) in ({schema_list})
+    AND lower(table_name) in ({table_list})
+    GROUP BY 1, 2
+)
+SELECT r.schema_name, r.table_name,
+       min(CASE WHEN r.is_up_to_date
+                THEN (r.row_count - nvl(d.deleted_rows, 0)) // CASE WHEN r.is_segmented THEN 1 ELSE r.nodes END
+           END) AS row_count,
+       max(s.statistics_updated), max(s.columns_without_statistics)
+FROM projection_rows r
+LEFT JOIN deleted d
+ON d.schema_name = r.schema_name
+AND d.projection_name = r.projection_name
+LEFT JOIN column_statistics s
+ON s.table_schema = r.schema_name
+AND s.table_name = r.table_name
+GROUP BY r.schema_name, r.table_name;
@@ -0,0 +1,4 @@
+select node_address
+from v_catalog.nodes
+where node_state = 'UP'
+order by node_name
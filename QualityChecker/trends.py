@@ -0,0 +1,81 @@
+"""
+Поиск аномалий по истории запусков (utils.history.HistoryStore).
+
+Каждая таблица сравнивается со своей же историей:
+- количество строк и ключей (проверки 10, 11, 12) - резкое изменение к прошлому запуску и выход
+  за обычный разброс (медиана и MAD за последние history_depth запусков);
+- свежесть (проверки 5, 14) - максимальная tech_load_ts откатилась назад или перестала расти,
+  хотя раньше росла от запуска к запуску.
+"""
+import datetime
+import statistics
+
+VOLUME_METRICS = ['stg_row_count', 'ods_row_count', 'bk_counts']
+FRESHNESS_METRICS = ['max_ts_ods', 'max_ts_stg']
+
+
+def _volume_anomalies(value, history, change_threshold, z_threshold, min_history):
+    numbers = [row[1] for row in history if row[1] is not None]
+    if not numbers:
+        return []
+    anomalies = []
+    previous = numbers[0]
+    change = (value - previous) / previous if previous else None
+    if change is not None and abs(change) >= change_threshold:
+        anomalies.append(('Резкое изменение к прошлому запуску', previous, change))
+    if len(numbers) >= min_history:
+        median = statistics.median(numbers)
+        mad = statistics.median(abs(number - median) for number in numbers)
+        # 0.6745 приводит MAD к стандартному отклонению нормального распределения
+        if mad and abs(0.6745 * (value - median) / mad) > z_threshold:
+            anomalies.append(('Вне обычного разброса', median, (value - median) / median if median else None))
+    return anomalies
+
+
+def _timestamp(text):
+    # 'Ошибка', 'Таймаут', 'Пропущено' и пустые значения - не время, в сравнении не участвуют
+    try:
+        timestamp = datetime.datetime.fromisoformat(str(text).strip())
+    except (TypeError, ValueError):
+        return None
+    # Время с часовым поясом и без сравнивается как время без пояса
+    return timestamp.replace(tzinfo=None)
+
+
+def _freshness_anomalies(value, history, min_history, advance_share):
+    current = _timestamp(value)
+    if current is None:
+        return []
+    timestamps = [timestamp for timestamp in (_timestamp(row[2]) for row in history) if timestamp is not None]
+    if not timestamps:
+        return []
+    previous = timestamps[0]
+    if current < previous:
+        return [('Откат назад', str(previous), None)]
+    if current == previous and len(timestamps) >= min_history:
+        advanced = sum(newer > older for newer, older in zip(timestamps, timestamps[1:]))
+        if advanced >= advance_share * (len(timestamps) - 1):
+            return [('Перестала расти', str(previous), None)]
+    return []
+
+
+def find_anomalies(store, history_depth=30, change_threshold=0.3, z_threshold=3.5, min_history=5,
+                   advance_share=0.8):
+    """Строки листа Anomalies по метрикам текущего запуска store."""
+    rows = []
+    current = store.current(VOLUME_METRICS + FRESHNESS_METRICS)
+    for (schema, table, column, metric), (value_num, value_text) in sorted(current.items()):
+        history = store.previous(schema, table, column, metric, history_depth)
+        if metric in VOLUME_METRICS:
+            if value_num is None:
+                continue
+            anomalies = _volume_anomalies(value_num, history, change_threshold, z_threshold, min_history)
+            value = value_num
+        else:
+            anomalies = _freshness_anomalies(value_text, history, min_history, advance_share)
+            value = value_text
+        for rule, baseline, change in anomalies:
+            rows.append({'schema': schema, 'table': table, 'metric': metric, 'value': value, 'baseline': baseline,
+                         'change_pct': None if change is None else round(change * 100, 2), 'rule': rule,
+                         'history_runs': len(history)})
+    return rows
@@ -0,0 +1,125 @@
+import threading
+import time
+
+
+class NodeBalancer:
+    """
+    Выбор ноды кластера для новой сессии.
+
+    Сессии распределяются по нодам-инициаторам так, чтобы сборку результатов не делала одна нода:
+    выбирается нода с наименьшей оценкой (открытые сессии + 1) * задержка, при равенстве - по кругу.
+    Задержка - экспоненциальное скользящее среднее (EWMA) дешевых замеров ноды: времени подключения и select 1
+    при выдаче сессии (не чаще раза в probe_seconds на ноду), плюс min_latency, чтобы быстрые замеры не обнуляли
+    оценку. Время самих проверок не учитывается: оно зависит от запроса, а не от ноды, и нода, которой достались
+    тяжелые запросы, не должна из-за этого оставаться без сессий. Нода без замеров считается не медленнее самой
+    быстрой.
+    Нода, к которой не удалось подключиться, исключается на время backoff, которое удваивается с каждой
+    ошибкой подряд (не больше max_backoff секунд) и сбрасывается после удачного подключения.
+    """
+
+    def __init__(self, nodes, alpha=0.2, backoff=5, max_backoff=300, min_latency=0.01, probe_seconds=60):
+        self.alpha = alpha
+        self.min_latency = min_latency
+        self.probe_seconds = probe_seconds
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._nodes = {}
+        self._order = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self.set_nodes(nodes)
+
+    def set_nodes(self, nodes):
+        """Заменяет список нод (например, после запроса к v_catalog.nodes), замеры известных нод сохраняются."""
+        with self._lock:
+            self._order = list(dict.fromkeys(nodes))
+            self._nodes = {node: self._nodes.get(node) or {'sessions': 0, 'latency': None, 'probed_at': 0.0,
+                                                           'queries': 0, 'failures': 0, 'down_until': 0.0}
+                           for node in self._order}
+
+    def nodes(self):
+        with self._lock:
+            return list(self._order)
+
+    def _score(self, node, default_latency):
+        state = self._nodes[node]
+        latency = state['latency'] if state['latency'] is not None else default_latency
+        return (state['sessions'] + 1) * (latency + self.min_latency)
+
+    def choose(self, exclude=()):
+        """Нода для новой сессии или None, если все ноды (кроме exclude) временно исключены."""
+        with self._lock:
+            now = time.time()
+            available = [node for node in self._order if node not in exclude
+                         and self._nodes[node]['down_until'] <= now]
+            if not available:
+                return None
+            latencies = [self._nodes[node]['latency'] for node in available
+                         if self._nodes[node]['latency'] is not None]
+            default_latency = min(latencies, default=1.0)
+            # Обход начинается с очередной ноды круга, min берет первую из равных
+            start = self._next % len(self._order)
+            self._next += 1
+            ring = self._order[start:] + self._order[:start]
+            return min((node for node in ring if node in available),
+                       key=lambda node: self._score(node, default_latency))
+
+    def next_retry(self):
+        """Через сколько секунд освободится первая исключенная нода."""
+        with self._lock:
+            if not self._nodes:
+                return 0.0
+            return max(0.0, min(state['down_until'] for state in self._nodes.values()) - time.time())
+
+    def connected(self, node):
+        with self._lock:
+            if node in self._nodes:
+                self._nodes[node]['sessions'] += 1
+                self._nodes[node]['failures'] = 0
+                self._nodes[node]['down_until'] = 0.0
+
+    def disconnected(self, node):
+        with self._lock:
+            if node in self._nodes:
+                self._nodes[node]['sessions'] = max(0, self._nodes[node]['sessions'] - 1)
+
+    def failed(self, node):
+        """Ошибка подключения или обрыв соединения: нода исключается на время backoff."""
+        with self._lock:
+            if node not in self._nodes:
+                return 0.0
+            state = self._nodes[node]
+            state['failures'] += 1
+            delay = min(self.backoff * 2 ** (state['failures'] - 1), self.max_backoff)
+            state['down_until'] = time.time() + delay
+            return delay
+
+    def needs_probe(self, node):
+        """Пора ли снова замерить задержку ноды."""
+        with self._lock:
+            return node in self._nodes and time.time() - self._nodes[node]['probed_at'] >= self.probe_seconds
+
+    def observe(self, node, seconds):
+        """Замер задержки ноды: время подключения или select 1."""
+        with self._lock:
+            if node not in self._nodes:
+                return
+            state = self._nodes[node]
+            state['probed_at'] = time.time()
+            state['latency'] = seconds if state['latency'] is None \
+                else self.alpha * seconds + (1 - self.alpha) * state['latency']
+
+    def queried(self, node):
+        with self._lock:
+            if node in self._nodes:
+                self._nodes[node]['queries'] += 1
+
+    def stats(self):
+        """Состояние нод: {нода: {'sessions', 'latency', 'queries', 'failures', 'down'}}."""
+        with self._lock:
+            now = time.time()
+            return {node: {'sessions': state['sessions'],
+                           'latency': None if state['latency'] is None else round(state['latency'], 3),
+                           'queries': state['queries'], 'failures': state['failures'],
+                           'down': state['down_until'] > now}
+                    for node, state in self._nodes.items()}
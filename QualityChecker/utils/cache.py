@@ -0,0 +1,170 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from utils.databaseTools import run_sql, template_path
+from utils.utils import read_file_content
+
+
+class ResultCache:
+    """
+    Кэш результатов проверок между запусками (SQLite-файл).
+
+    Ключ - (среда, схема, таблица, проверка, аргументы, хэш SQL-шаблонов). Результат переиспользуется,
+    пока не изменился отпечаток пары ODS/STG таблиц по мете хранения (projection_storage, delete_vectors).
+    Результат хранится через pickle: из кэша возвращаются те же типы (datetime, Decimal, кортежи), что и при запуске.
+    """
+
+    def __init__(self, cache_path, env, dialect, cur_path, vertica_conn_dict):
+        self.env = env
+        self.dialect = dialect
+        self.cur_path = cur_path
+        self.vertica_conn_dict = vertica_conn_dict
+        self._fingerprints = {}
+        self._hits = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("""create table if not exists results (
+                                env text, schema_name text, table_name text, check_name text, args_hash text,
+                                template_hash text, fingerprint text, result blob, created_at text,
+                                primary key (env, schema_name, table_name, check_name, args_hash, template_hash))""")
+        self._db.commit()
+
+    @staticmethod
+    def pair_key(schema, table):
+        # ODS и STG таблица инвалидируются вместе: проверки 6, 10, 13, 14 зависят от обеих
+        return schema.replace('STG_', 'ODS_').lower(), table.lower()
+
+    def _table_fingerprint(self, schema, table):
+        script = read_file_content(template_path(
+            self.dialect, self.cur_path, 'sql/work_with_meta/vertica/select_table_fingerprint.sql')).format(
+            schema_name=schema, table=table)
+        return run_sql(self.dialect, script, self.vertica_conn_dict)[0]
+
+    def fingerprint(self, schema, table):
+        """Отпечаток пары таблиц считается один раз за запуск. None - таблицу не кэшируем."""
+        key = self.pair_key(schema, table)
+        with self._lock:
+            if key in self._fingerprints:
+                return self._fingerprints[key]
+        ods_schema = schema.replace('STG_', 'ODS_')
+        stg_schema = ods_schema.replace('ODS_', 'STG_')
+        try:
+            ods_fingerprint = self._table_fingerprint(ods_schema, table)
+            stg_fingerprint = self._table_fingerprint(stg_schema, table)
+            fingerprint = None if ods_fingerprint[0] is None else json.dumps([ods_fingerprint, stg_fingerprint],
+                                                                            default=str)
+        except Exception:
+            logging.warning(f'Не удалось получить отпечаток {schema}.{table}, кэш для нее не используется')
+            fingerprint = None
+        with self._lock:
+            self._fingerprints[key] = fingerprint
+        return fingerprint
+
+    def get(self, schema, table, check_name, args_hash, template_hash):
+        fingerprint = self.fingerprint(schema, table)
+        if fingerprint is None:
+            return False, None
+        with self._lock:
+            row = self._db.execute("""select fingerprint, result from results
+                                      where env = ? and schema_name = ? and table_name = ? and check_name = ?
+                                      and args_hash = ? and template_hash = ?""",
+                                   (self.env, *self.pair_key(schema, table), check_name, args_hash,
+                                    template_hash)).fetchone()
+            if row is None or row[0] != fingerprint:
+                return False, None
+            key = self.pair_key(schema, table)
+            self._hits[key] = self._hits.get(key, 0) + 1
+        return True, pickle.loads(row[1])
+
+    def put(self, schema, table, check_name, args_hash, template_hash, result):
+        fingerprint = self.fingerprint(schema, table)
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._db.execute("insert or replace into results values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (self.env, *self.pair_key(schema, table), check_name, args_hash, template_hash,
+                              fingerprint, pickle.dumps(result), time.strftime('%Y-%m-%d %H:%M:%S')))
+            self._db.commit()
+
+    def hits(self, schema, table):
+        with self._lock:
+            return self._hits.get(self.pair_key(schema, table), 0)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Кэши по подключениям: при запуске по нескольким средам у каждой среды свой
+_result_caches = {}
+
+
+def _connection_key(vertica_conn_dict):
+    return repr(sorted(vertica_conn_dict.items()))
+
+
+def set_result_cache(cache):
+    _result_caches[_connection_key(cache.vertica_conn_dict)] = cache
+
+
+def get_result_cache(vertica_conn_dict):
+    return _result_caches.get(_connection_key(vertica_conn_dict))
+
+
+def close_result_caches():
+    for cache in _result_caches.values():
+        cache.close()
+    _result_caches.clear()
+
+
+def cached_check(*templates):
+    """
+    Декоратор для функций checks.py. Если кэш включен (set_result_cache), результат берется из него,
+    пока таблица не изменилась. В ключ входят аргументы вызова и содержимое перечисленных SQL-шаблонов
+    в варианте диалекта вызова (template_path).
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        template_hashes = {}
+
+        def template_hash(dialect):
+            if dialect not in template_hashes:
+                template_hashes[dialect] = hashlib.md5(''.join(
+                    read_file_content(template_path(dialect, base_path, template))
+                    for template in templates).encode('utf8')).hexdigest()
+            return template_hashes[dialect]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _result_caches:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            cache = get_result_cache(bound.arguments['vertica_conn_dict'])
+            if cache is None:
+                return func(*args, **kwargs)
+            call_args = {name: value for name, value in bound.arguments.items()
+                         if name not in ('vertica_conn_dict', 'catalog', 'state')}
+            args_hash = hashlib.md5(json.dumps(call_args, sort_keys=True, default=str).encode('utf8')).hexdigest()
+            schema, table = bound.arguments['schema'], bound.arguments['table']
+            templates_hash = template_hash(bound.arguments['dialect'])
+
+            hit, result = cache.get(schema, table, func.__name__, args_hash, templates_hash)
+            if hit:
+                logging.info(f'{schema}.{table}: {func.__name__} из кэша')
+                return result
+            result = func(*args, **kwargs)
+            cache.put(schema, table, func.__name__, args_hash, templates_hash, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+import time
+
+from utils.databaseTools import run_sql, template_path
+from utils.utils import read_file_content
+
+TECH_COLUMNS = ('tech_load_ts', 'tech_job_id', 'tech_is_deleted')
+
+
+def _key(schema, table):
+    return schema.lower(), table.lower()
+
+
+class Catalog:
+    """
+    Метаданные всех проверяемых таблиц (ODS и парных STG), загруженные заранее несколькими запросами.
+    Ключ - (схема, таблица) без учета регистра, как ilike в запросах к мете.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._primary_keys = {}
+        self._row_counts = {}
+        self._storage = {}
+
+    def add_column(self, schema, table, column, data_type, char_max_length):
+        self._columns.setdefault(_key(schema, table), []).append((column, data_type, char_max_length))
+
+    def add_primary_key(self, schema, table, column):
+        self._primary_keys.setdefault(_key(schema, table), []).append(column)
+
+    def set_row_count(self, schema, table, row_count):
+        self._row_counts[_key(schema, table)] = row_count
+
+    def set_storage(self, schema, table, row_count, statistics_updated, columns_without_statistics):
+        self._storage[_key(schema, table)] = {'row_count': row_count, 'statistics_updated': statistics_updated,
+                                              'columns_without_statistics': columns_without_statistics,
+                                              'loaded_at': time.time()}
+
+    def __contains__(self, schema_table):
+        return _key(*schema_table) in self._columns
+
+    def columns(self, schema, table):
+        return [col for col, _, _ in self._columns.get(_key(schema, table), [])]
+
+    def text_columns(self, schema, table):
+        return [col for col, data_type, _ in self._columns.get(_key(schema, table), [])
+                if 'char' in data_type.lower()]
+
+    def char_max_length(self, schema, table):
+        return {col: length for col, data_type, length in self._columns.get(_key(schema, table), [])
+                if 'char' in data_type.lower()}
+
+    def primary_keys(self, schema, table):
+        return list(self._primary_keys.get(_key(schema, table), []))
+
+    def row_count(self, schema, table):
+        # Оценка по projection_storage (сумма по всем проекциям), годится только для сравнения таблиц между собой
+        return self._row_counts.get(_key(schema, table)) or 0
+
+    def storage(self, schema, table):
+        """Мета хранения режима catalog-first или None, если она не загружалась."""
+        return self._storage.get(_key(schema, table))
+
+    def exact_row_count(self, schema, table):
+        # None - меты нет или супер-проекция не актуальна, строки нужно считать запросом
+        storage = self.storage(schema, table)
+        return None if storage is None else storage['row_count']
+
+    def business_columns(self, schema, table):
+        pk_columns = set(self.primary_keys(schema, table))
+        return [col for col in self.columns(schema, table) if col not in pk_columns and col not in TECH_COLUMNS]
+
+
+def _schema_list(obj_list):
+    schemas = set()
+    for schema, _ in obj_list:
+        schemas.add(schema.lower())
+        schemas.add(schema.replace('ODS_', 'STG_').lower())
+    return sorted(schemas)
+
+
+def _read_meta_template(dialect, cur_path, name):
+    return read_file_content(template_path(dialect, cur_path, 'sql/work_with_meta/vertica', name))
+
+
+def load_storage(dialect, cur_path, obj_list, connection, catalog):
+    """
+    Загружает в catalog мету хранения (точное количество строк, время статистики) таблиц obj_list и их пар в STG.
+    Одним запросом; повторный вызов для одной таблицы обновляет устаревшую мету.
+    """
+    schema_list = ', '.join(f"'{schema}'" for schema in _schema_list(obj_list))
+    table_list = ', '.join(f"'{table}'" for table in sorted({table.lower() for _, table in obj_list}))
+    if not schema_list:
+        return catalog
+    storage = run_sql(dialect, _read_meta_template(dialect, cur_path, 'select_table_storage_bulk.sql').format(
+        schema_list=schema_list, table_list=table_list), connection)
+    for schema, table, row_count, statistics_updated, columns_without_statistics in storage:
+        catalog.set_storage(schema, table, row_count, statistics_updated, columns_without_statistics)
+    return catalog
+
+
+def load_catalog(dialect, cur_path, obj_list, connection, catalog_first=False):
+    """
+    Загружает колонки, первичные ключи и оценку количества строк для всех таблиц из obj_list и их пар в STG,
+    при catalog_first - еще и мету хранения (load_storage). Количество запросов к мете не зависит от количества таблиц.
+    """
+    schema_list = ', '.join(f"'{schema}'" for schema in _schema_list(obj_list))
+    tables = {table.lower() for _, table in obj_list}
+
+    def read_meta_template(name):
+        return _read_meta_template(dialect, cur_path, name)
+
+    catalog = Catalog()
+    if not schema_list:
+        return catalog
+
+    columns = run_sql(dialect, read_meta_template('select_all_columns_bulk.sql').format(
+        schema_list=schema_list), connection)
+    for schema, table, column, data_type, char_max_length in columns:
+        if table.lower() in tables:
+            catalog.add_column(schema, table, column, data_type, char_max_length)
+
+    primary_keys = run_sql(dialect, read_meta_template('select_primary_key_columns_bulk.sql').format(
+        schema_list=schema_list), connection)
+    for schema, table, column in primary_keys:
+        if table.lower() in tables:
+            catalog.add_primary_key(schema, table, column)
+
+    row_counts = run_sql(dialect, read_meta_template('select_table_row_counts_bulk.sql').format(
+        schema_list=schema_list), connection)
+    for schema, table, row_count in row_counts:
+        if table.lower() in tables:
+            catalog.set_row_count(schema, table, row_count)
+    if catalog_first:
+        load_storage(dialect, cur_path, obj_list, connection, catalog)
+    return catalog
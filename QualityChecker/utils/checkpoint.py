@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import threading
+
+# Задачи с этими статусами при продолжении запуска не пересчитываются. 'timeout' - результат упрощенного варианта
+# или отметка 'Таймаут': повторный запуск упрется в тот же бюджет времени
+DONE_STATUSES = ('ok', 'timeout')
+
+
+def _ends_with_newline(file_path):
+    with open(file_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class CheckpointJournal:
+    """
+    Журнал прогресса запуска (JSON Lines, только дописывается): результат каждой задачи проверок таблицы
+    записывается сразу, как задача закончилась, и сбрасывается на диск.
+
+    Прошлые записи читаются только при продолжении запуска (resume=True): готовые задачи берутся из журнала,
+    упавшие ('error'), пропущенные ('skipped') и отсутствующие пересчитываются. Первая строка журнала - отпечаток
+    настроек, от которых зависят результаты (fingerprint). Продолжить запуск с другими настройками нельзя,
+    а новый запуск не может писать в журнал существующего.
+    Последняя строка, оборванная падением посреди записи, пропускается.
+    """
+
+    def __init__(self, journal_path, fingerprint, resume=False):
+        self.journal_path = journal_path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._empty = set()
+        self._header = None
+        os.makedirs(os.path.dirname(journal_path) or '.', exist_ok=True)
+        exists = os.path.isfile(journal_path)
+        if exists and not resume:
+            raise FileExistsError(f'{journal_path}: журнал уже есть, новый запуск в него не пишет')
+        if exists:
+            with open(journal_path, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        self._load(json.loads(line))
+                    except ValueError:
+                        logging.warning(f'{journal_path}: пропущена поврежденная запись журнала')
+            if self._header != fingerprint:
+                raise ValueError(f'{journal_path}: запуск начат с другими проверками или настройками '
+                                 f'({self._header} вместо {fingerprint}), продолжить его нельзя')
+        self._file = open(journal_path, 'a', encoding='utf8')
+        if self._file.tell() and not _ends_with_newline(journal_path):
+            # Оборванная запись остается отдельной строкой и не склеивается со следующей
+            self._file.write('\n')
+        if not exists:
+            self._append({'fingerprint': fingerprint})
+
+    @staticmethod
+    def _key(schema, table):
+        return f'{schema}.{table}'.lower()
+
+    @staticmethod
+    def _checks_key(checks):
+        # Порядок проверок не влияет на ключ, как и на отпечаток настроек (api.settings_fingerprint)
+        return tuple(sorted(checks))
+
+    def _load(self, record):
+        if 'fingerprint' in record:
+            self._header = record['fingerprint']
+            return
+        key = self._key(record['schema'], record['table'])
+        if record['task'] is None:
+            self._empty.add((key, self._checks_key(record['checks'])))
+        else:
+            self._tasks[(key, record['task'], self._checks_key(record['checks']))] = record
+
+    def _append(self, record):
+        with self._lock:
+            self._load(record)
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_task(self, schema, table, task, checks, status, result):
+        """result - (значения для General, {колонка: значения для Detail}) задачи task."""
+        general, detail = result
+        self._append({'schema': schema, 'table': table, 'task': task, 'checks': list(checks), 'status': status,
+                      'general': general, 'detail': detail})
+
+    def record_empty(self, schema, table, checks):
+        self._append({'schema': schema, 'table': table, 'task': None, 'checks': list(checks), 'status': 'empty'})
+
+    def task_result(self, schema, table, task, checks):
+        """Готовый результат задачи из журнала или None, если задачу нужно выполнить."""
+        with self._lock:
+            record = self._tasks.get((self._key(schema, table), task, self._checks_key(checks)))
+        if record is None or record['status'] not in DONE_STATUSES:
+            return None
+        return record['general'], record['detail']
+
+    def is_empty(self, schema, table, checks):
+        with self._lock:
+            return (self._key(schema, table), self._checks_key(checks)) in self._empty
+
+    def stats(self):
+        """Количество задач журнала по статусам."""
+        with self._lock:
+            statuses = [record['status'] for record in self._tasks.values()]
+        return {status: statuses.count(status) for status in set(statuses)}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -1,26 +1,608 @@
-import vertica_python
-from utils.utils  import to_flat_list, read_file_content
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
+from utils import localdb
+from utils.balancer import NodeBalancer
+from utils.trace import get_tracer, sql_hash
+from utils.utils import to_flat_list, read_file_content
 
-def run_sql(dialect: str ,sql_script: str, vertica_conn_dict: dict):
+
+class QueryTimeout(Exception):
+    """Запрос не уложился в отведенное время и был отменен на сервере."""
+
+
+_time_limit = threading.local()
+
+
+@contextmanager
+def query_time_limit(seconds):
+    """
+    Ограничивает по времени все запросы текущего потока внутри блока. seconds=None - без ограничения.
+    Вложенные ограничения не расширяют внешнее: действует самый ранний срок.
+    """
+    previous = getattr(_time_limit, 'deadline', None)
+    deadline = previous
+    if seconds is not None:
+        deadline = time.time() + seconds if previous is None else min(previous, time.time() + seconds)
+    _time_limit.deadline = deadline
+    try:
+        yield
+    finally:
+        _time_limit.deadline = previous
+
+
+def remaining_query_time():
+    """Сколько секунд осталось у запросов текущего потока, None - ограничения нет."""
+    deadline = getattr(_time_limit, 'deadline', None)
+    return None if deadline is None else deadline - time.time()
+
+
+# Параметры среды в conf.py, которые нужны пулу, а не драйверу: список нод кластера ('hosts') и
+# запрос списка работающих нод из v_catalog.nodes при первом подключении ('discover_nodes')
+POOL_OPTIONS = ('hosts', 'discover_nodes')
+
+
+class SessionPool:
+    """
+    Пул сессий к одной среде Vertica.
+
+    Сессии открываются лениво, переиспользуются между запросами и проверяются
+    перед выдачей. Одновременно выдается не больше max_size сессий.
+    Сессии распределяются по нодам кластера (NodeBalancer): при ошибке подключения нода временно
+    исключается и сессия открывается на следующей, до connect_retries кругов по всем нодам.
+    Драйвер vertica_python импортируется при первом подключении, для локального бэкенда он не нужен.
+    """
+
+    def __init__(self, vertica_conn_dict: dict, max_size: int = 4, idle_check_seconds: int = 300,
+                 connect_retries: int = 3):
+        self.vertica_conn_dict = vertica_conn_dict
+        self.max_size = max_size
+        self.idle_check_seconds = idle_check_seconds
+        self.connect_retries = connect_retries
+        self.connections_opened = 0
+        self.queries_executed = 0
+        self.reconnects = 0
+        self.failovers = 0
+        self._idle = []
+        self._node_of = {}
+        self._lock = threading.Lock()
+        self._discover_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.balancer = NodeBalancer(vertica_conn_dict.get('hosts') or [vertica_conn_dict.get('host') or ''])
+        self._discover = bool(vertica_conn_dict.get('discover_nodes'))
+        self._errors = None
+
+    def _resolve_errors(self):
+        # Ошибки обрыва соединения, любые ошибки драйвера и ошибка отмены запроса. Типы берутся из драйвера
+        # при первом обращении, чтобы пул создавался без него
+        if self._errors is None:
+            self._errors = self._error_types()
+        return self._errors
+
+    @property
+    def connection_errors(self):
+        return self._resolve_errors()[0]
+
+    @property
+    def driver_errors(self):
+        return self._resolve_errors()[1]
+
+    @property
+    def canceled_errors(self):
+        return self._resolve_errors()[2]
+
+    @staticmethod
+    def _error_types():
+        from vertica_python import errors
+        return (errors.ConnectionError, OSError), (errors.Error, OSError), (errors.QueryCanceled,)
+
+    def _open(self, node):
+        import vertica_python
+        params = {key: value for key, value in self.vertica_conn_dict.items() if key not in POOL_OPTIONS}
+        return vertica_python.connect(**{**params, 'host': node})
+
+    @staticmethod
+    def _is_closed(connection):
+        return connection.closed()
+
+    @staticmethod
+    def _cancel(connection):
+        connection.cancel()
+
+    def _discover_nodes(self, connection):
+        """Заменяет список нод работающими нодами кластера. Запрашивается один раз, по первой сессии."""
+        with self._discover_lock:
+            if not self._discover:
+                return
+            self._discover = False
+            try:
+                cur = connection.cursor()
+                cur.execute(read_file_content(_SQL_PATH, 'work_with_meta/vertica/select_up_nodes.sql'))
+                nodes = to_flat_list(cur.fetchall())
+            except self.driver_errors as error:
+                logging.warning(f'Не удалось получить список нод кластера: {error!r}')
+                return
+            if nodes:
+                self.balancer.set_nodes(nodes)
+                logging.info(f'Ноды кластера: {", ".join(nodes)}')
+
+    def _connect(self):
+        last_error = None
+        for attempt in range(self.connect_retries):
+            tried = set()
+            while True:
+                node = self.balancer.choose(exclude=tried)
+                if node is None:
+                    break
+                tried.add(node)
+                started = time.time()
+                try:
+                    connection = self._open(node)
+                except self.connection_errors as error:
+                    last_error = error
+                    delay = self.balancer.failed(node)
+                    with self._lock:
+                        self.failovers += 1
+                    logging.warning(f'Нода {node} недоступна ({error!r}), исключена на {delay} с, '
+                                    f'подключаемся к следующей')
+                    continue
+                self.balancer.connected(node)
+                self.balancer.observe(node, time.time() - started)
+                with self._lock:
+                    self.connections_opened += 1
+                    self._node_of[id(connection)] = node
+                self._discover_nodes(connection)
+                return connection
+            if attempt + 1 < self.connect_retries:
+                # Все ноды исключены: ждем, пока истечет исключение первой из них
+                time.sleep(self.balancer.next_retry())
+        if last_error is not None:
+            raise last_error
+        raise OSError(f'Нет доступных нод: {", ".join(map(str, self.balancer.nodes()))}')
+
+    def node(self, connection):
+        """Нода, на которой открыта сессия."""
+        with self._lock:
+            return self._node_of.get(id(connection))
+
+    def _pick_idle(self):
+        # Из свободных сессий берем сессию ноды, которую выбрал бы балансировщик. Вызывается под self._lock
+        idle_nodes = {self._node_of.get(id(connection)) for connection, _ in self._idle}
+        node = self.balancer.choose(exclude=[node for node in self.balancer.nodes() if node not in idle_nodes])
+        for index in range(len(self._idle) - 1, -1, -1):
+            if self._node_of.get(id(self._idle[index][0])) == node:
+                return index
+        return len(self._idle) - 1
+
+    def _is_alive(self, connection, last_used):
+        if self._is_closed(connection):
+            return False
+        node = self.node(connection)
+        if time.time() - last_used < self.idle_check_seconds and not self.balancer.needs_probe(node):
+            return True
+        # Сессия долго простаивала - сервер мог ее закрыть. Тот же select 1 - замер задержки ноды
+        try:
+            started = time.time()
+            cur = connection.cursor()
+            cur.execute('select 1')
+            cur.fetchall()
+            self.balancer.observe(node, time.time() - started)
+            return True
+        except self.driver_errors:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop(self._pick_idle())
+            if self._is_alive(connection, last_used):
+                return connection
+            self._close_quietly(connection)
+        return self._connect()
+
+    def _close_quietly(self, connection):
+        with self._lock:
+            node = self._node_of.pop(id(connection), None)
+        self.balancer.disconnected(node)
+        try:
+            connection.close()
+        except self.driver_errors:
+            pass
+
+    @contextmanager
+    def session(self):
+        """Выдает сессию из пула. Сломанная сессия в пул не возвращается."""
+        self._slots.acquire()
+        connection = None
+        try:
+            connection = self._checkout()
+            yield connection
+        except self.connection_errors:
+            if connection is not None:
+                # Обрыв сессии - вероятно, нода упала: новые сессии пойдут на другие ноды
+                self.balancer.failed(self.node(connection))
+                self._close_quietly(connection)
+                connection = None
+            raise
+        finally:
+            if connection is not None:
+                with self._lock:
+                    self._idle.append((connection, time.time()))
+            self._slots.release()
+
+    @staticmethod
+    def _run(connection, sql_script: str, timings: dict):
+        started = time.time()
+        cur = connection.cursor()
+        cur.execute(sql_script)
+        fetch_started = time.time()
+        result = cur.fetchall() if cur.description else []
+        timings['execute_s'] = round(fetch_started - started, 3)
+        timings['fetch_s'] = round(time.time() - fetch_started, 3)
+        timings['rows'] = len(result)
+        return result
+
+    def _run_limited(self, connection, sql_script: str, timings: dict):
+        remaining = remaining_query_time()
+        if remaining is None:
+            return self._run(connection, sql_script, timings)
+        if remaining <= 0:
+            raise QueryTimeout('Время на запрос закончилось до его запуска')
+
+        # По истечении времени отправляем серверу отмену запроса, сессия после этого остается рабочей.
+        # Отмена и завершение запроса идут под общей блокировкой, а сессия возвращается вызывающему только
+        # после остановки таймера: опоздавшая отмена не попадет в следующий запрос этой сессии
+        lock = threading.Lock()
+        state = {'finished': False, 'canceled': False}
+
+        def cancel():
+            with lock:
+                if not state['finished']:
+                    state['canceled'] = True
+                    self._cancel(connection)
+        timer = threading.Timer(remaining, cancel)
+        timer.daemon = True
+        timer.start()
+        try:
+            return self._run(connection, sql_script, timings)
+        except self.canceled_errors:
+            if state['canceled']:
+                raise QueryTimeout(f'Запрос отменен через {remaining:.1f} с')
+            raise
+        finally:
+            with lock:
+                state['finished'] = True
+            timer.cancel()
+            timer.join()
+
+    def _fetch(self, connection, sql_script: str):
+        node = self.node(connection)
+        tracer = get_tracer()
+        if tracer is None:
+            timings = {}
+            result = self._run_limited(connection, sql_script, timings)
+            self.balancer.queried(node)
+            return result
+        label = None
+        script = sql_script
+        if tracer.server_cost and _SELECT_START.match(sql_script):
+            # Метка нужна, чтобы потом найти запрос в query_requests
+            label = tracer.next_label()
+            script = _SELECT_START.sub(f'select /*+label({label})*/ ', sql_script, count=1)
+        with tracer.measure('query', sql_hash=sql_hash(sql_script), label=label, node=node) as timings:
+            result = self._run_limited(connection, script, timings)
+        self.balancer.queried(node)
+        return result
+
+    def execute(self, sql_script: str):
+        for attempt in range(1, self.connect_retries + 1):
+            node = None
+            try:
+                with self.session() as connection:
+                    node = self.node(connection)
+                    result = self._fetch(connection, sql_script)
+                with self._lock:
+                    self.queries_executed += 1
+                return result
+            except self.connection_errors:
+                # Если сессию не удалось открыть ни на одной ноде, _connect уже перебрал их с паузами
+                if node is None or attempt == self.connect_retries:
+                    raise
+                with self._lock:
+                    self.reconnects += 1
+                logging.warning(f'Соединение с {node} потеряно, повторяем запрос на другой ноде')
+
+    def execute_in(self, connection, sql_script: str):
+        """Выполняет запрос в уже выданной сессии (для последовательности запросов с временными таблицами)."""
+        result = self._fetch(connection, sql_script)
+        with self._lock:
+            self.queries_executed += 1
+        return result
+
+    def stream_in(self, connection, sql_script: str, batch_size: int = 10000):
+        """
+        Отдает результат запроса частями по batch_size строк: первой - имена колонок, затем списки строк.
+        Строки читаются из соединения по мере обработки, в памяти клиента одна пачка.
+        """
+        cur = connection.cursor()
+        cur.execute(sql_script)
+        yield [column[0] for column in cur.description]
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        with self._lock:
+            self.queries_executed += 1
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'connections_opened': self.connections_opened,
+                    'queries_executed': self.queries_executed,
+                    'reconnects': self.reconnects,
+                    'failovers': self.failovers}
+
+
+class SQLitePool(SessionPool):
+    """Пул соединений локального бэкенда (utils.localdb). Параметры подключения - {'database': папка со схемами}."""
+
+    @staticmethod
+    def _error_types():
+        return (OSError,), (sqlite3.Error, OSError), (sqlite3.OperationalError,)
+
+    def _open(self, node):
+        return localdb.connect(self.vertica_conn_dict)
+
+    @staticmethod
+    def _is_closed(connection):
+        return False
+
+    @staticmethod
+    def _cancel(connection):
+        connection.interrupt()
+
+
+# Реализации пула по диалекту
+BACKENDS = {
+    'Vertica': SessionPool,
+    'SQLite': SQLitePool,
+}
+
+# Варианты шаблонов для диалектов, отличных от Vertica: папка шаблонов Vertica -> папка вариантов.
+# Если варианта нет, используется шаблон Vertica (простые запросы подходят обоим диалектам)
+TEMPLATE_VARIANTS = {
+    'SQLite': {'sql/DQ': 'sql/DQ/sqlite', 'sql/work_with_meta/vertica': 'sql/work_with_meta/sqlite'},
+}
+
+# Сравнение с учетом NULL (NULL равен NULL)
+NULL_SAFE_EQUAL = {
+    'Vertica': '<=>',
+    'SQLite': 'IS',
+}
+
+
+def template_path(dialect: str, *args):
+    """Путь к шаблону для диалекта. Аргументы - как у read_file_content: путь или папка и имя файла."""
+    filepath = os.path.normpath(os.path.join(*args))
+    for folder, variant_folder in TEMPLATE_VARIANTS.get(dialect, {}).items():
+        folder = os.sep + os.path.normpath(folder) + os.sep
+        if folder in filepath:
+            variant = filepath.replace(folder, os.sep + os.path.normpath(variant_folder) + os.sep, 1)
+            if os.path.isfile(variant):
+                return variant
+    return filepath
+
+
+_SELECT_START = re.compile(r'^\s*select\s', re.IGNORECASE)
+_SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(vertica_conn_dict: dict):
+    return repr(sorted(vertica_conn_dict.items()))
+
+
+def _backend(dialect: str):
+    if dialect not in BACKENDS:
+        raise ValueError(f'Неизвестный диалект {dialect}, доступны: {", ".join(BACKENDS)}')
+    return BACKENDS[dialect]
+
+
+def configure_pool(vertica_conn_dict: dict, max_size: int, dialect: str = 'Vertica'):
+    """Создает пул для среды с заданным размером. Вызывать до первого запроса."""
+    backend = _backend(dialect)
+    with _pools_lock:
+        key = _pool_key(vertica_conn_dict)
+        if key in _pools:
+            _pools[key].close()
+        _pools[key] = backend(vertica_conn_dict, max_size=max_size)
+        return _pools[key]
+
+
+def get_pool(vertica_conn_dict: dict, dialect: str = 'Vertica') -> SessionPool:
+    backend = _backend(dialect)
+    with _pools_lock:
+        key = _pool_key(vertica_conn_dict)
+        if key not in _pools:
+            _pools[key] = backend(vertica_conn_dict)
+        return _pools[key]
+
+
+def pool_stats() -> dict:
+    """Суммарное количество открытых соединений и выполненных запросов по всем пулам."""
+    total = {'connections_opened': 0, 'queries_executed': 0, 'reconnects': 0, 'failovers': 0}
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for key, value in pool.stats().items():
+            total[key] += value
+    return total
+
+
+def node_stats(vertica_conn_dict: dict, dialect: str = 'Vertica') -> dict:
+    """Сессии, задержка (EWMA, с), запросы и ошибки по нодам среды (NodeBalancer.stats)."""
+    return get_pool(vertica_conn_dict, dialect).balancer.stats()
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
+
+
+class QueryMemo:
+    """
+    Запоминает результаты запросов в пределах одного запуска. Одинаковые (после нормализации) запросы
+    к одной среде выполняются один раз, в том числе если их одновременно запросили несколько потоков.
     """
 
+    # Запросы с побочными эффектами или зависящие от сессии не запоминаются
+    NOT_MEMOIZED = ('analyze_statistics', 'current_session', 'random(')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(sql_script):
+        sql_script = re.sub(r'--[^\n]*', ' ', sql_script)
+        return re.sub(r'\s+', ' ', sql_script).strip().rstrip(';').strip()
+
+    def is_memoizable(self, normalized):
+        lowered = normalized.lower()
+        return lowered.startswith(('select', 'with')) and not any(word in lowered for word in self.NOT_MEMOIZED)
+
+    def execute(self, key, run):
+        while True:
+            with self._lock:
+                if key in self._results:
+                    self.hits += 1
+                    return list(self._results[key])
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Такой же запрос уже выполняется в другом потоке - ждем его результат, но не дольше,
+            # чем осталось времени у запросов этого потока
+            remaining = remaining_query_time()
+            if remaining is None:
+                event.wait()
+            elif remaining <= 0 or not event.wait(remaining):
+                raise QueryTimeout('Время на запрос закончилось в ожидании такого же запроса другого потока')
+        try:
+            result = run()
+            with self._lock:
+                self._results[key] = result
+            return list(result)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+_query_memo = None
+
+
+def start_query_memo():
+    """Включает запоминание запросов на время запуска. Повторный вызов сбрасывает накопленные результаты."""
+    global _query_memo
+    _query_memo = QueryMemo()
+    return _query_memo
+
+
+def stop_query_memo():
+    global _query_memo
+    memo, _query_memo = _query_memo, None
+    return memo.stats() if memo is not None else None
+
+
+def query_memo_stats():
+    return _query_memo.stats() if _query_memo is not None else None
+
+
+def _execute(dialect: str, sql_script: str, vertica_conn_dict: dict):
+    return get_pool(vertica_conn_dict, dialect).execute(sql_script)
+
+
+@contextmanager
+def sql_session(dialect: str, vertica_conn_dict: dict):
+    """
+    Выдает функцию run(sql_script), которая выполняет запросы в одной и той же сессии.
+    Нужна для локальных временных таблиц. Такие запросы не запоминаются QueryMemo.
+    run.stream(sql_script, batch_size) читает результат в той же сессии по частям (см. SessionPool.stream_in).
+    """
+    pool = get_pool(vertica_conn_dict, dialect)
+    with pool.session() as connection:
+        def run(sql_script):
+            return pool.execute_in(connection, sql_script)
+        run.stream = lambda sql_script, batch_size=10000: pool.stream_in(connection, sql_script, batch_size)
+        yield run
+
+
+def run_sql(dialect: str, sql_script: str, vertica_conn_dict: dict):
+    """
+
+    :param dialect:
     :param sql_script:
     :param vertica_conn_dict:
     :raise ValueError:
     :return:
     """
-    if dialect == 'Vertica':
-    	with vertica_python.connect(**vertica_conn_dict) as connection:
-        	cur = connection.cursor()
-        	cur.execute(sql_script)
-        	result = cur.fetchall()
-        	return result
+    memo = _query_memo
+    if memo is not None:
+        normalized = memo.normalize(sql_script)
+        if memo.is_memoizable(normalized):
+            key = (dialect, _pool_key(vertica_conn_dict), normalized)
+            return memo.execute(key, lambda: _execute(dialect, sql_script, vertica_conn_dict))
+    return _execute(dialect, sql_script, vertica_conn_dict)
+
+
+def select_server_costs(dialect, cur_path, labels, vertica_conn_dict, batch_size=500):
+    """Стоимость помеченных запросов на сервере: {метка: {'server_ms', 'server_cpu_us', 'server_memory_mb'}}."""
+    costs = {}
+    template = read_file_content(cur_path, 'sql/work_with_meta/vertica/select_query_costs.sql')
+    for i in range(0, len(labels), batch_size):
+        label_list = ', '.join(f"'{label}'" for label in labels[i:i + batch_size])
+        for label, duration_ms, cpu_us, memory_mb in run_sql(dialect, template.format(label_list=label_list),
+                                                             vertica_conn_dict):
+            costs[label] = {'server_ms': duration_ms, 'server_cpu_us': cpu_us, 'server_memory_mb': memory_mb}
+    return costs
 
 
 def select_columns(dialect, cur_path, col_type,  schema, table, connection):
-    dialect_path_dict = {'Vertica': f'{cur_path}/sql/work_with_meta/vertica/select_all_columns.sql'}
-    col_type_dict = {'all': 'true', 'text': 'data_type ilike \'%char%\''}
+    dialect_path_dict = {'Vertica': f'{cur_path}/sql/work_with_meta/vertica/select_all_columns.sql',
+                         'SQLite': f'{cur_path}/sql/work_with_meta/sqlite/select_all_columns.sql'}
+    col_type_dict = {'all': 'true', 'text': 'lower(data_type) like \'%char%\''}
     columns = run_sql(dialect, read_file_content(dialect_path_dict[dialect]).format(table=table, schema_name=schema,
                                                                                where_clause=col_type_dict[col_type]),
                           connection)
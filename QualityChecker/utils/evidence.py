@@ -0,0 +1,61 @@
+import os
+import re
+import threading
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf8', errors='replace')
+    return str(value)
+
+
+class EvidenceSink:
+    """
+    Выгрузка строк, из-за которых проверка не прошла, в Parquet-файлы папки evidence_dir.
+
+    Строки приходят пачками (SessionPool.stream_in) и сразу дописываются в файл, поэтому память клиента
+    не зависит от количества плохих строк. В файл попадает не больше row_cap строк.
+    Все значения пишутся строками: файл нужен человеку для разбора, а не для расчетов.
+    pyarrow импортируется только при первой выгрузке.
+    """
+
+    def __init__(self, evidence_dir, row_cap=100000, batch_size=10000):
+        self.evidence_dir = evidence_dir
+        self.row_cap = row_cap
+        self.batch_size = batch_size
+        self._files = []
+        self._lock = threading.Lock()
+        os.makedirs(evidence_dir, exist_ok=True)
+
+    def write(self, schema, table, check, batches):
+        """batches - сначала имена колонок, затем пачки строк. Возвращает количество выгруженных строк."""
+        import pyarrow
+        import pyarrow.parquet
+
+        batches = iter(batches)
+        columns = next(batches)
+        arrow_schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        file_name = re.sub(r'[^\w.-]', '_', f'{schema}.{table}.check{check}') + '.parquet'
+        file_path = os.path.join(self.evidence_dir, file_name)
+
+        rows = 0
+        with pyarrow.parquet.ParquetWriter(file_path, arrow_schema) as writer:
+            for batch in batches:
+                # Оставшиеся пачки дочитываются, чтобы сессия вернулась в пул без недочитанного результата
+                batch = batch[:self.row_cap - rows]
+                if not batch:
+                    continue
+                writer.write_table(pyarrow.Table.from_pydict(
+                    {column: [_text(row[i]) for row in batch] for i, column in enumerate(columns)},
+                    schema=arrow_schema))
+                rows += len(batch)
+        with self._lock:
+            self._files.append({'schema': schema, 'table': table, 'check': check, 'rows': rows,
+                                'capped': int(rows >= self.row_cap), 'file': file_path})
+        return rows
+
+    def files(self):
+        with self._lock:
+            return list(self._files)
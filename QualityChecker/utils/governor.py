@@ -0,0 +1,51 @@
+import time
+
+
+class TimeGovernor:
+    """
+    Бюджеты времени запуска.
+
+    check_limits - {номер проверки: секунды}, для остальных проверок действует default_check_limit.
+    table_limit - сколько секунд можно потратить на все проверки одной таблицы.
+    run_limit - срок всего запуска: после low_priority_share его доли низкоприоритетные проверки
+    пропускаются, после истечения срока пропускаются все оставшиеся проверки.
+    None везде означает "без ограничения".
+    """
+
+    def __init__(self, check_limits=None, default_check_limit=None, table_limit=None, run_limit=None,
+                 low_priority_checks=(6, 7, 8), low_priority_share=0.8):
+        self.check_limits = dict(check_limits or {})
+        self.default_check_limit = default_check_limit
+        self.table_limit = table_limit
+        self.run_limit = run_limit
+        self.low_priority_checks = set(low_priority_checks)
+        self.low_priority_share = low_priority_share
+        self.started = time.time()
+
+    def table_deadline(self):
+        return None if self.table_limit is None else time.time() + self.table_limit
+
+    def run_expired(self):
+        return self.run_limit is not None and time.time() - self.started >= self.run_limit
+
+    def is_low_priority(self, task_checks):
+        return all(check in self.low_priority_checks for check in task_checks)
+
+    def should_skip(self, task_checks):
+        if self.run_expired():
+            return True
+        if self.run_limit is None or not self.is_low_priority(task_checks):
+            return False
+        return time.time() - self.started >= self.run_limit * self.low_priority_share
+
+    def task_limit(self, task_checks, table_deadline=None):
+        """Сколько секунд можно дать задаче по таблице с учетом всех бюджетов, None - без ограничения."""
+        limits = [self.check_limits[check] for check in task_checks if check in self.check_limits]
+        limits = [max(limits)] if limits else [self.default_check_limit]
+        now = time.time()
+        if table_deadline is not None:
+            limits.append(table_deadline - now)
+        if self.run_limit is not None:
+            limits.append(self.started + self.run_limit - now)
+        limits = [limit for limit in limits if limit is not None]
+        return max(0, min(limits)) if limits else None
@@ -0,0 +1,94 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+# Оценка приближенного режима: '~123 ±1.25%' (checks.approximate_value)
+_APPROXIMATE = re.compile(r'~\s*(-?\d+(?:\.\d+)?)')
+
+
+def _number(value):
+    # Оценки приближенного режима тоже числа (берется оценка без погрешности); 'Ошибка', 'Таймаут' и даты - нет
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    approximate = _APPROXIMATE.match(str(value))
+    if approximate:
+        return float(approximate.group(1))
+    try:
+        return float(str(value))
+    except ValueError:
+        return None
+
+
+class HistoryStore:
+    """
+    История метрик всех запусков (SQLite-файл, только дописывается).
+
+    Каждое значение листов General и Detail - одна строка (среда, запуск, схема, таблица, колонка, метрика).
+    Числовое значение хранится отдельно от текстового, индекс по (среда, схема, таблица, метрика, время запуска)
+    позволяет быстро достать историю одной метрики по тысячам запусков.
+    """
+
+    def __init__(self, history_path, env, run_id=None):
+        self.env = env
+        self.run_id = run_id or time.strftime('%Y%m%d%H%M%S')
+        self.run_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(history_path, check_same_thread=False)
+        self._db.executescript("""
+            create table if not exists metrics (
+                env text, run_id text, run_at text, schema_name text, table_name text, column_name text,
+                metric text, value_num real, value_text text);
+            create index if not exists metrics_history
+                on metrics (env, schema_name, table_name, metric, column_name, run_at);
+            create index if not exists metrics_run on metrics (env, run_id);
+        """)
+        self._db.commit()
+
+    def append(self, sheet_rows, key_fields=('schema', 'table', 'column')):
+        """Дописывает строки листа General или Detail текущего запуска."""
+        records = []
+        for row in sheet_rows:
+            schema, table, column = (row.get(field) for field in key_fields)
+            for metric, value in row.items():
+                if metric in key_fields or value is None:
+                    continue
+                records.append((self.env, self.run_id, self.run_at, schema.lower(), table.lower(),
+                                (column or '').lower(), metric, _number(value), str(value)))
+        with self._lock:
+            self._db.executemany('insert into metrics values (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+            self._db.commit()
+
+    def discard_run(self):
+        """Удаляет уже записанные метрики текущего запуска, чтобы продолжение запуска не задвоило их."""
+        with self._lock:
+            self._db.execute('delete from metrics where env = ? and run_id = ?', (self.env, self.run_id))
+            self._db.commit()
+
+    def current(self, metrics):
+        """Значения метрик таблиц текущего запуска: {(схема, таблица, колонка, метрика): (число, текст)}."""
+        with self._lock:
+            rows = self._db.execute(f"""select schema_name, table_name, column_name, metric, value_num, value_text
+                                        from metrics where env = ? and run_id = ?
+                                        and metric in ({', '.join('?' * len(metrics))})""",
+                                    (self.env, self.run_id, *metrics)).fetchall()
+        return {tuple(row[:4]): row[4:] for row in rows}
+
+    def previous(self, schema, table, column, metric, limit):
+        """Значения метрики за limit прошлых запусков, от последнего к первому: [(запуск, число, текст)]."""
+        with self._lock:
+            return self._db.execute("""select run_id, value_num, value_text from metrics
+                                       where env = ? and schema_name = ? and table_name = ? and metric = ?
+                                       and column_name = ? and run_id <> ?
+                                       order by run_at desc limit ?""",
+                                    (self.env, schema, table, metric, column or '', self.run_id,
+                                     limit)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,146 @@
+"""
+Локальный бэкенд на SQLite для прогона проверок без кластера Vertica (бенчмарки, отладка шаблонов).
+
+Параметры подключения - {'database': папка}. Каждый файл <СХЕМА>.sqlite из папки подключается как схема,
+поверх них создаются временные представления с именами каталога Vertica (columns, primary_keys, nodes,
+projection_storage), а функции Vertica, которые используют шаблоны (HASH, MAKEUTF8, TO_CHAR, NVL...),
+регистрируются как пользовательские функции.
+
+Vertica не проверяет уникальность первичного ключа, SQLite - проверяет, поэтому ключи таблиц
+с возможными дублями задаются таблицей dq_primary_keys (table_name, column_name, ordinal_position) в файле схемы.
+"""
+import glob
+import hashlib
+import os
+import sqlite3
+
+PRIMARY_KEYS_TABLE = 'dq_primary_keys'
+
+
+def _hash(*values):
+    # Детерминированный неотрицательный хэш (встроенный hash() в Python меняется между процессами)
+    return int.from_bytes(hashlib.md5(repr(values).encode('utf8')).digest()[:8], 'big') >> 1
+
+
+def _to_char(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    return str(value)
+
+
+def _makeutf8(value):
+    if isinstance(value, bytes):
+        return value.decode('utf8', errors='replace')
+    return value
+
+
+def _octet_length(value):
+    if value is None:
+        return None
+    return len(value) if isinstance(value, bytes) else len(str(value).encode('utf8'))
+
+
+def _bit_length(value):
+    length = _octet_length(value)
+    return None if length is None else length * 8
+
+
+def _mod(value, divisor):
+    if value is None or divisor is None:
+        return None
+    return value % divisor
+
+
+def _nvl(value, default):
+    return default if value is None else value
+
+
+class _ApproximateCountDistinct:
+    """Локально APPROXIMATE_COUNT_DISTINCT считается точно."""
+
+    def __init__(self):
+        self.values = set()
+
+    def step(self, value, error_tolerance=None):
+        if value is not None:
+            self.values.add(value)
+
+    def finalize(self):
+        return len(self.values)
+
+
+def _register_functions(connection):
+    connection.create_function('hash', -1, _hash, deterministic=True)
+    connection.create_function('to_char', 1, _to_char, deterministic=True)
+    connection.create_function('makeutf8', 1, _makeutf8, deterministic=True)
+    connection.create_function('octet_length', 1, _octet_length, deterministic=True)
+    connection.create_function('bit_length', 1, _bit_length, deterministic=True)
+    connection.create_function('mod', 2, _mod, deterministic=True)
+    connection.create_function('nvl', 2, _nvl, deterministic=True)
+    connection.create_function('analyze_statistics', 1, lambda name: 0)
+    connection.create_aggregate('approximate_count_distinct', 1, _ApproximateCountDistinct)
+    connection.create_aggregate('approximate_count_distinct', 2, _ApproximateCountDistinct)
+
+
+def _schema_files(database_dir):
+    return {os.path.splitext(os.path.basename(file))[0]: file
+            for file in sorted(glob.glob(os.path.join(database_dir, '*.sqlite')))}
+
+
+def _create_catalog_views(connection, schemas):
+    columns, primary_keys, row_counts = [], [], []
+    for schema in schemas:
+        tables = [row[0] for row in connection.execute(
+            f"select name from \"{schema}\".sqlite_master where type = 'table' "
+            f"and name not like 'sqlite%' and name <> '{PRIMARY_KEYS_TABLE}'")]
+        # Длина varchar берется из объявленного типа: varchar(100) -> 100
+        columns.append(f"""select '{schema}' as table_schema, m.name as table_name, p.name as column_name,
+                                  lower(p.type) as data_type,
+                                  case when instr(p.type, '(') > 0
+                                       then cast(substr(p.type, instr(p.type, '(') + 1) as integer) end
+                                       as character_maximum_length,
+                                  p.cid + 1 as ordinal_position
+                           from "{schema}".sqlite_master m
+                           join pragma_table_info(m.name, '{schema}') p
+                           where m.type = 'table' and m.name not like 'sqlite%'
+                           and m.name <> '{PRIMARY_KEYS_TABLE}'""")
+        primary_keys.append(f"""select '{schema}' as table_schema, m.name as table_name, p.name as column_name,
+                                       p.pk as ordinal_position, 1 as constraint_id
+                                from "{schema}".sqlite_master m
+                                join pragma_table_info(m.name, '{schema}') p
+                                where m.type = 'table' and p.pk > 0""")
+        has_keys_table = connection.execute(
+            f"select 1 from \"{schema}\".sqlite_master where name = '{PRIMARY_KEYS_TABLE}'").fetchone()
+        if has_keys_table:
+            primary_keys.append(f"""select '{schema}', table_name, column_name, ordinal_position, 1
+                                    from "{schema}".{PRIMARY_KEYS_TABLE}""")
+        row_counts.extend(f"""select '{schema}' as anchor_table_schema, '{table}' as anchor_table_name,
+                                     (select count(1) from "{schema}"."{table}") as row_count,
+                                     0 as used_bytes, 1 as ros_count"""
+                          for table in tables)
+
+    empty = {
+        'columns': "select '' as table_schema, '' as table_name, '' as column_name, '' as data_type, "
+                   "null as character_maximum_length, 0 as ordinal_position where 0",
+        'primary_keys': "select '' as table_schema, '' as table_name, '' as column_name, 0 as ordinal_position, "
+                        "0 as constraint_id where 0",
+        'projection_storage': "select '' as anchor_table_schema, '' as anchor_table_name, 0 as row_count, "
+                              "0 as used_bytes, 0 as ros_count where 0",
+    }
+    for view, parts in (('columns', columns), ('primary_keys', primary_keys), ('projection_storage', row_counts)):
+        connection.execute(f'create temp view {view} as {" union all ".join(parts) if parts else empty[view]}')
+    # Одна "нода": сегментация локально всегда 100 %
+    connection.execute('create temp view nodes as select 1 as node_id')
+
+
+def connect(conn_dict):
+    """Открывает соединение с подключенными схемами, функциями и представлениями каталога."""
+    connection = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+    # Строки с битыми байтами (проверка 4) не должны ронять выборку
+    connection.text_factory = lambda value: value.decode('utf8', errors='replace')
+    _register_functions(connection)
+    schemas = _schema_files(conn_dict['database'])
+    for schema, file in schemas.items():
+        connection.execute(f'attach database ? as "{schema}"', (file,))
+    _create_catalog_views(connection, schemas)
+    return connection
@@ -0,0 +1,65 @@
+import csv
+import glob
+import os
+import threading
+
+
+class ReportSink:
+    """
+    Журнал отчета: каждый лист (General, Detail, ...) - отдельный CSV в папке journal_dir.
+    Строки дописываются в конец по мере готовности таблиц, файл отчета целиком не перечитывается.
+    xlsx собирается один раз в конце через render_xlsx.
+    """
+
+    def __init__(self, journal_dir, sheets=('General', 'Detail')):
+        self.journal_dir = journal_dir
+        self.sheets = list(sheets)
+        self._fieldnames = {}
+        self._lock = threading.Lock()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def sheet_path(self, sheet):
+        return os.path.join(self.journal_dir, f'{sheet}.csv')
+
+    def clear(self):
+        """Удаляет листы журнала, например чтобы собрать их заново при продолжении прерванного запуска."""
+        with self._lock:
+            for sheet_path in glob.glob(os.path.join(self.journal_dir, '*.csv')):
+                os.remove(sheet_path)
+            self._fieldnames = {}
+
+    def write(self, sheet, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            if sheet not in self.sheets:
+                self.sheets.append(sheet)
+            sheet_path = self.sheet_path(sheet)
+            fieldnames = self._fieldnames.get(sheet)
+            if fieldnames is None and os.path.isfile(sheet_path):
+                with open(sheet_path, 'r', encoding='utf8', newline='') as f:
+                    fieldnames = next(csv.reader(f), None)
+            new_file = fieldnames is None
+            if new_file:
+                fieldnames = list(rows[0].keys())
+            self._fieldnames[sheet] = fieldnames
+            with open(sheet_path, 'a', encoding='utf8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+
+    def render_xlsx(self, xlsx_path):
+        """Собирает xlsx из журнала с теми же листами и колонками, что и раньше."""
+        import pandas
+
+        with pandas.ExcelWriter(xlsx_path) as writer:
+            for sheet in self.sheets:
+                sheet_path = self.sheet_path(sheet)
+                if os.path.isfile(sheet_path):
+                    df = pandas.read_csv(sheet_path, encoding='utf8')
+                else:
+                    df = pandas.DataFrame()
+                df.to_excel(writer, sheet_name=sheet, index=False)
+        return xlsx_path
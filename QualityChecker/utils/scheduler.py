@@ -0,0 +1,32 @@
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_parallel(items, worker, max_workers, priority=None):
+    """
+    Выполняет worker(item) для каждого элемента на пуле из max_workers потоков.
+
+    Задачи запускаются в порядке убывания priority(item) (самые большие таблицы первыми),
+    а результаты отдаются генератором в исходном порядке items: (item, result, error).
+    Ошибка одного элемента не останавливает остальные - она возвращается в error.
+    """
+    items = list(items)
+    order = range(len(items))
+    if priority is not None:
+        order = sorted(order, key=lambda i: priority(items[i]), reverse=True)
+
+    def call(item):
+        try:
+            return worker(item), None
+        except Exception as error:
+            logging.error(f'Ошибка при обработке {item}:\n{traceback.format_exc()}')
+            return None, error
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [None] * len(items)
+        for i in order:
+            futures[i] = executor.submit(call, items[i])
+        for item, future in zip(items, futures):
+            result, error = future.result()
+            yield item, result, error
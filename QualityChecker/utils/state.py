@@ -0,0 +1,41 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class StateStore:
+    """
+    Локальное состояние между запусками (SQLite-файл): водяные знаки tech_load_ts и накопленные результаты проверок.
+    Ключ - 'схема.таблица' и раздел по проверке. set() записывает только свой раздел одной транзакцией,
+    поэтому стоимость записи не растет с количеством таблиц, а падение посреди записи не портит состояние.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(state_path, check_same_thread=False)
+        self._db.execute('create table if not exists state (table_key text, section text, value text, '
+                         'primary key (table_key, section))')
+        self._db.commit()
+
+    @staticmethod
+    def _key(schema, table):
+        return f'{schema}.{table}'.lower()
+
+    def get(self, schema, table, section):
+        with self._lock:
+            row = self._db.execute('select value from state where table_key = ? and section = ?',
+                                   (self._key(schema, table), section)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, schema, table, section, value):
+        with self._lock:
+            self._db.execute('insert or replace into state values (?, ?, ?)',
+                             (self._key(schema, table), section, json.dumps(value, ensure_ascii=False, default=str)))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
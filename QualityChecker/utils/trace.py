@@ -0,0 +1,130 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Поля листа Timings в порядке колонок
+TIMING_FIELDS = ['kind', 'env', 'schema', 'table', 'check', 'function', 'column', 'sql_hash', 'label', 'node',
+                 'started', 'wall_s', 'execute_s', 'fetch_s', 'rows', 'server_ms', 'server_cpu_us', 'server_memory_mb',
+                 'error']
+
+_context = threading.local()
+
+
+@contextmanager
+def trace_context(**fields):
+    """Поля (schema, table, check, column...), которые добавляются ко всем замерам текущего потока внутри блока."""
+    previous = getattr(_context, 'fields', {})
+    _context.fields = {**previous, **{key: value for key, value in fields.items() if value is not None}}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+def current_context():
+    return dict(getattr(_context, 'fields', {}))
+
+
+def sql_hash(sql_script):
+    return hashlib.md5(sql_script.encode('utf8')).hexdigest()[:12]
+
+
+class Tracer:
+    """
+    Замеры запуска: время каждого запроса (выполнение и выборка отдельно), количество строк и время проверок.
+
+    Каждый замер сразу дописывается строкой JSON в trace_path, чтобы трассы разных запусков можно было
+    сравнивать, и хранится в памяти для листа Timings. При server_cost = True запросы помечаются
+    LABEL-подсказкой, и в конце запуска по меткам подтягивается стоимость на сервере (query_requests,
+    execution_engine_profiles).
+    """
+
+    def __init__(self, trace_path, server_cost=False):
+        self.trace_path = trace_path
+        self.server_cost = server_cost
+        self.run_id = time.strftime('%Y%m%d%H%M%S')
+        self._records = []
+        self._labels = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(trace_path) or '.', exist_ok=True)
+
+    def next_label(self):
+        with self._lock:
+            self._labels += 1
+            return f'qc_{self.run_id}_{self._labels}'
+
+    def record(self, kind, **fields):
+        record = {'kind': kind, 'run_id': self.run_id, **current_context(), **fields}
+        with self._lock:
+            self._records.append(record)
+            with open(self.trace_path, 'a', encoding='utf8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        return record
+
+    def add_server_costs(self, costs):
+        """costs - {метка: {'server_ms':..., 'server_cpu_us':..., 'server_memory_mb':...}}."""
+        with self._lock:
+            for record in self._records:
+                if record.get('label') in costs:
+                    record.update(costs[record['label']])
+        for label, cost in costs.items():
+            self.record('server', label=label, **cost)
+
+    def labels(self, env=None):
+        with self._lock:
+            return [record['label'] for record in self._records
+                    if record.get('label') and env in (None, record.get('env'))]
+
+    def timing_rows(self, env=None):
+        """Строки листа Timings, при env - только замеры этой среды."""
+        with self._lock:
+            return [{field: record.get(field) for field in TIMING_FIELDS}
+                    for record in self._records if record['kind'] != 'server' and env in (None, record.get('env'))]
+
+    @contextmanager
+    def measure(self, kind, **fields):
+        """Замеряет время блока. В yield отдается словарь, в который можно дописать поля замера."""
+        extra = {}
+        started = time.time()
+        try:
+            yield extra
+        except Exception as error:
+            extra['error'] = type(error).__name__
+            raise
+        finally:
+            self.record(kind, started=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+                        wall_s=round(time.time() - started, 3), **fields, **extra)
+
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def traced_check(func):
+    """Декоратор для функций checks.py: замеряет время проверки целиком, включая ответы из кэша."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return func(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs).arguments
+        with trace_context(schema=arguments.get('schema'), table=arguments.get('table'),
+                           function=func.__name__, column=arguments.get('column')):
+            with tracer.measure('check'):
+                return func(*args, **kwargs)
+    return wrapper